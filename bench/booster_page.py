@@ -0,0 +1,75 @@
+"""
+Микро-бенчмарк разбора страницы создания наборов.
+Сравнивает прежний способ (BeautifulSoup + eval) с BoosterCreatorPage.
+
+Запуск из корня проекта:
+    python -m bench.booster_page [сохраненная_страница.html ...]
+Без аргументов используется сгенерированная страница.
+"""
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+from bench.fixtures import booster_creator_page
+from logic.parsers import BoosterCreatorPage
+
+
+def soup_extract(content: bytes):
+    """Прежний разбор страницы (для сравнения)"""
+    soup = BeautifulSoup(content, 'html.parser')
+    script = next(
+        x for x in soup.find_all('script')
+        if x.contents and 'CBoosterCreatorPage.Init' in x.contents[0]
+    )
+    bundles_string = next(
+        x for x in script.string.split('\r\n\t\t\t')
+        if 'appid' in x and 'name' in x
+    )
+    bundles = eval(
+        bundles_string.replace('true', 'True').replace('false', 'False')
+    )
+    query = 'span', {'class': 'goovalue'}
+    gems = int(soup.find(*query).contents[0].replace(',', ''))
+    query = 'a', {'class': 'menuitem supernav username'}
+    url_elements = soup.find(*query).attrs['href'].split('/')
+    username = url_elements[url_elements.index('id') + 1]
+    return bundles[0], gems, username
+
+
+def fast_extract(content: bytes):
+    page = BoosterCreatorPage(content)
+    return page.bundles, page.gems_amount, page.username
+
+
+def same_result(content: bytes):
+    soup_bundles, *soup_rest = soup_extract(content)
+    fast_bundles, *fast_rest = fast_extract(content)
+    return soup_rest == fast_rest and [
+        (int(x['appid']), x['name'], int(x['price'])) for x in soup_bundles
+    ] == [(x.appid, x.name, x.price) for x in fast_bundles.values()]
+
+
+def run(name: str, content: bytes, number: int = 5):
+    assert same_result(content), name
+    soup_time = min(timeit.repeat(
+        lambda: soup_extract(content), number=number, repeat=3
+    )) / number
+    fast_time = min(timeit.repeat(
+        lambda: fast_extract(content), number=number, repeat=3
+    )) / number
+    print(
+        f'{name} ({len(content) / 1024:.0f} KB): '
+        f'soup {soup_time * 1000:.2f} ms, '
+        f'extractor {fast_time * 1000:.2f} ms, '
+        f'x{soup_time / fast_time:.1f}'
+    )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as f:
+                run(path, f.read())
+    else:
+        run('generated', booster_creator_page())
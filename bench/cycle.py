@@ -0,0 +1,172 @@
+"""
+Бенчмарк полного цикла бота на локальной замене Steam (bench.stand_in).
+Для каждой фазы make_money выводит время, количество запросов к каждому
+адресу, время разбора страниц и пиковое потребление памяти.
+Паузы бота и ограничение частоты запросов на время прогона отключены.
+Время разбора суммируется по всем потокам основного процесса (разбор
+в процессах конвейера проверки не учитывается, для замера нужен
+--parse-processes 0), а tracemalloc заметно замедляет прогон
+(его можно отключить флагом --no-memory).
+
+Запуск из корня проекта:
+    python -m bench.cycle [--bundles 400] [--latency-ms 50] [--concurrency 4]
+                          [--error-rate 0.05] [--parse-processes 2]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import settings
+from bench.stand_in import SteamStandIn
+
+COOKIES = 'sessionid=bench; steamLoginSecure=bench'
+
+
+class ParseTimer:
+    """Подсчет времени, потраченного на разбор страниц"""
+
+    def __init__(self):
+        self.total = 0.
+
+    def wrap(self, func):
+        def run(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.total += time.perf_counter() - started
+        return run
+
+    def take(self):
+        total, self.total = self.total, 0.
+        return total
+
+
+def skip_cycle_sleep(seconds, account=None, new_rescan_only=False):
+    """Сна между циклами нет, а паузы перед повторами запросов есть"""
+    if new_rescan_only:
+        time.sleep(seconds)
+
+
+def prepare(base_url: str, concurrency: int, work_dir: str,
+            parse_processes: int):
+    """Настройка бота на работу с заменой Steam во временной папке"""
+    # Файлы логов бота создаются в текущей папке
+    os.chdir(work_dir)
+    from cargo.utils import RateLimiter
+    from logic import parsers, pipeline, user
+    from logic.history import PriceHistory
+    from logic.logs import Logs
+    from logic.storage import Storage, StatsStorage
+    from logic.transport import CircuitBreaker, RetryPolicy
+
+    Logs.setup()
+    logging.getLogger('info_logger').setLevel(logging.WARNING)
+    Storage.FOLDER_PATH = os.path.join(work_dir, 'db')
+    Storage.STORAGE_PATH = os.path.join(Storage.FOLDER_PATH, 'storage')
+    StatsStorage.STORAGE_PATH = os.path.join(
+        Storage.FOLDER_PATH, 'statistics'
+    )
+    PriceHistory.PATH = os.path.join(Storage.FOLDER_PATH, 'price_history.bin')
+    Storage.create_folder_path()
+
+    user.SteamUser.BASE_URL = base_url
+    user.SteamUser.SLEEP = staticmethod(skip_cycle_sleep)
+    user.SteamUser.SCAN_CONCURRENCY = concurrency
+    user.SteamUser.RATE_LIMITER = RateLimiter(0)
+    # Повторы без пауз, но Retry-After замены Steam соблюдается
+    user.SteamUser.RETRY_POLICY = RetryPolicy(base_delay=0)
+    user.SteamUser.CIRCUIT_BREAKER = CircuitBreaker(pause=0)
+
+    pipeline.ScanPipeline.PARSE_PROCESSES = parse_processes
+
+    parse_timer = ParseTimer()
+    user.BeautifulSoup = parse_timer.wrap(user.BeautifulSoup)
+    parsers.BeautifulSoup = parse_timer.wrap(parsers.BeautifulSoup)
+
+    class TimedBoosterCreatorPage(user.BoosterCreatorPage):
+        __init__ = parse_timer.wrap(user.BoosterCreatorPage.__init__)
+
+    user.BoosterCreatorPage = TimedBoosterCreatorPage
+    return user.SteamUser, parse_timer
+
+
+def run(args):
+    stand_in = SteamStandIn(
+        bundles_count=args.bundles, latency=args.latency_ms / 1000,
+        error_rate=args.error_rate
+    )
+    base_url = stand_in.start()
+    work_dir = tempfile.mkdtemp(prefix='steam_crafter_bench_')
+    steam_user_class, parse_timer = prepare(
+        base_url, args.concurrency, work_dir, args.parse_processes
+    )
+    steam = None
+
+    def create_user():
+        nonlocal steam
+        steam = steam_user_class(COOKIES)
+
+    phases = (
+        ('init', create_user),
+        ('profitability', lambda: steam.get_all_bundles_profitability()),
+        ('craft', lambda: steam.create_card_available_bundles()),
+        ('sell', lambda: steam.sell_exists_bundles()),
+    )
+    if args.memory:
+        tracemalloc.start()
+    report = []
+    for name, phase in phases:
+        if args.memory:
+            tracemalloc.reset_peak()
+        stand_in.take_counts()
+        parse_timer.take()
+        started = time.perf_counter()
+        phase()
+        wall_time = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory() if args.memory else (0, 0)
+        report.append(
+            (name, wall_time, parse_timer.take(), peak, stand_in.take_counts())
+        )
+    if args.memory:
+        tracemalloc.stop()
+    stand_in.stop()
+    steam.session.close()
+
+    print(
+        f'bundles={args.bundles} latency={args.latency_ms}ms '
+        f'concurrency={args.concurrency} '
+        f'parse_processes={args.parse_processes}'
+    )
+    for name, wall_time, parse_time, peak, counts in report:
+        requests_count = sum(counts.values())
+        print(
+            f'{name:<14} wall {wall_time:8.2f} s | parse {parse_time:6.2f} s'
+            f' | peak {peak / 2 ** 20:7.1f} MB | requests {requests_count}'
+        )
+        for endpoint, count in sorted(counts.items()):
+            print(f'{"":<16}{endpoint:<28}{count}')
+    total = sum(x[1] for x in report)
+    print(f'{"total":<14} wall {total:8.2f} s')
+    quotes = steam_user_class.QUOTES.stats()
+    print(
+        f'{"quotes":<14} hits {quotes["hits"]} | misses {quotes["misses"]}'
+        f' | cached {quotes["size"]}'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--bundles', type=int, default=400)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument(
+        '--parse-processes', type=int, default=settings.PARSE_PROCESSES
+    )
+    parser.add_argument('--no-memory', dest='memory', action='store_false')
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,214 @@
+"""Генерация страниц Steam, похожих на настоящие, для бенчмарков"""
+import json
+import random
+
+# Как и у настоящих страниц, кодировка объявлена в разметке, иначе
+# BeautifulSoup угадывает ее через chardet, что дороже самого разбора
+META_CHARSET = (
+    '<meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
+)
+
+
+def booster_creator_page(bundles_count: int = 400, gems_amount: int = 12345,
+                         username: str = 'benchuser', seed: int = 0):
+    """
+    Страница tradingcards/boostercreator со списком наборов
+    :return: тело страницы в байтах
+    """
+    rnd = random.Random(seed)
+    bundles = []
+    for num in range(bundles_count):
+        bundle = dict(
+            appid=100000 + num,
+            name=f'Bench Game {num}',
+            series=1,
+            price=str(rnd.choice((300, 400, 461, 545, 600, 666, 705, 1200)))
+        )
+        if rnd.random() < .2:
+            bundle['unavailable'] = True
+            bundle['available_at_time'] = '14 Nov @ 6:49pm'
+        bundles.append(bundle)
+    # Настоящая страница большая: шапка, меню и десятки скриптов
+    filler = ''.join(
+        f'<div class="responsive_menu_item" data-id="{num}">'
+        f'<a href="https://store.steampowered.com/app/{num}/">'
+        f'Menu item {num}</a></div>\r\n'
+        for num in range(1500)
+    )
+    scripts = ''.join(
+        f'<script type="text/javascript">\r\n\t\tvar g_Var{num} = {num};'
+        f'\r\n\t\tInitWidget( "widget_{num}" );\r\n\t</script>\r\n'
+        for num in range(60)
+    )
+    page = (
+        '<!DOCTYPE html>\r\n<html class="responsive">\r\n<head>\r\n'
+        f'{META_CHARSET}\r\n'
+        '<title>Steam Community :: Booster Pack Creator</title>\r\n'
+        f'{scripts}</head>\r\n<body>\r\n'
+        '<div id="global_actions">\r\n'
+        '<a class="menuitem supernav username" '
+        f'href="https://steamcommunity.com/id/{username}/" '
+        'data-tooltip-type="selector" '
+        f'data-tooltip-content=".submenu_username">{username}</a>\r\n'
+        '</div>\r\n'
+        f'{filler}'
+        '<div class="booster_creator_goostatus">\r\n'
+        '<div class="goo_display"><span class="goovalue">'
+        f'{gems_amount:,}</span> Gems</div>\r\n</div>\r\n'
+        '<script type="text/javascript">\r\n'
+        '\t$J( function() {\r\n'
+        '\t\tCBoosterCreatorPage.Init(\r\n'
+        f'\t\t\t{json.dumps(bundles, separators=(",", ":"))},\r\n'
+        f'\t\t\t{gems_amount},\r\n'
+        '\t\t\t"https://steamcommunity.com/tradingcards/boostercreator/"\r\n'
+        '\t\t);\r\n'
+        '\t} );\r\n'
+        '</script>\r\n'
+        f'{filler}'
+        '</body>\r\n</html>\r\n'
+    )
+    return page.encode('utf-8')
+
+
+def market_search_page(results):
+    """
+    Страница market/search
+    :param results: список (appid предмета, market_hash_name)
+    """
+    rows = ''.join(
+        '<a class="market_listing_row_link" href="#">\r\n'
+        '<div class="market_listing_row market_recent_listing_row '
+        'market_listing_searchresult" '
+        f'id="result_{num}" data-appid="{appid}" '
+        f'data-hash-name="{hash_name}">\r\n'
+        f'<span class="market_listing_item_name">{hash_name}</span>\r\n'
+        '</div>\r\n</a>\r\n'
+        for num, (appid, hash_name) in enumerate(results)
+    )
+    page = (
+        f'<!DOCTYPE html>\r\n<html>\r\n<head>{META_CHARSET}</head>\r\n'
+        '<body>\r\n'
+        f'<div id="searchResultsRows">\r\n{rows}</div>\r\n'
+        '</body>\r\n</html>\r\n'
+    )
+    return page.encode('utf-8')
+
+
+def market_search_render(packs, start: int, total_count: int):
+    """
+    Ответ market/search/render с norender=1
+    :param packs: список (appid игры, имя игры, цена продажи)
+    """
+    results = [
+        dict(
+            name=f'{name} Booster Pack',
+            hash_name=f'{appid}-{name} Booster Pack',
+            sell_listings=7,
+            sell_price=sell_price,
+            sell_price_text=f'{sell_price / 100:.2f} pуб.',
+            app_name='Steam',
+            asset_description=dict(
+                appid=753, classid=str(appid), instanceid='0',
+                market_hash_name=f'{appid}-{name} Booster Pack',
+                type=f'{name} Booster Pack'
+            )
+        )
+        for appid, name, sell_price in packs
+    ]
+    return dict(
+        success=True,
+        start=start,
+        pagesize=len(results),
+        total_count=total_count,
+        results=results
+    )
+
+
+def market_listing_page(item_nameid: int):
+    """Страница предмета market/listings/{appid}/{market_hash_name}"""
+    filler = ''.join(
+        f'<div class="market_listing_row" id="listing_{num}">'
+        f'<span class="market_listing_price">{num},00 pуб.</span></div>\r\n'
+        for num in range(300)
+    )
+    page = (
+        f'<!DOCTYPE html>\r\n<html>\r\n<head>{META_CHARSET}</head>\r\n'
+        '<body>\r\n'
+        f'{filler}'
+        '<script type="text/javascript">\r\n'
+        '\t\tvar g_rgAssets = [];\r\n'
+        '\t\t$J(function() {\r\n'
+        f'\t\tMarket_LoadOrderSpread( {item_nameid} );\t// initial load\r\n'
+        '\t\t});\r\n'
+        '</script>\r\n'
+        '</body>\r\n</html>\r\n'
+    )
+    return page.encode('utf-8')
+
+
+def order_histogram(lowest_sell, highest_buy):
+    """Ответ market/itemordershistogram"""
+    return dict(
+        success=1,
+        sell_order_count='25',
+        buy_order_count='117',
+        lowest_sell_order=str(lowest_sell) if lowest_sell else None,
+        highest_buy_order=str(highest_buy) if highest_buy else None,
+        sell_order_graph=[],
+        buy_order_graph=[],
+    )
+
+
+def inventory_page(steam_id: str, username: str):
+    """Страница инвентаря id/{username}/inventory/"""
+    page = (
+        f'<!DOCTYPE html>\r\n<html>\r\n<head>{META_CHARSET}</head>\r\n'
+        '<body>\r\n'
+        '<select id="responsive_inventory_select">'
+        '<option value="#753" data-appid="753">Steam</option>'
+        '<option value="#730" data-appid="730">Counter-Strike 2</option>'
+        '</select>\r\n'
+        '<script type="text/javascript">\r\n'
+        f'\t\tg_strProfileURL = "https://steamcommunity.com/id/{username}";'
+        f'\r\n\t\tUserYou.SetSteamId( \'{steam_id}\' );\r\n'
+        '</script>\r\n'
+        '</body>\r\n</html>\r\n'
+    )
+    return page.encode('utf-8')
+
+
+def inventory(items, total_count: int = None, last_assetid=None):
+    """
+    Ответ inventory/{steam_id}/753/6
+    :param items: список (assetid, classid, имя набора) текущей страницы
+    :param total_count: размер всего инвентаря
+    :param last_assetid: последний предмет страницы, если есть следующая
+    """
+    assets, descriptions = [], []
+    for assetid, classid, name in items:
+        assets.append(dict(
+            appid=753, contextid='6', assetid=str(assetid),
+            classid=str(classid), instanceid='0', amount='1'
+        ))
+        descriptions.append(dict(
+            appid=753, classid=str(classid), instanceid='0',
+            name=f'{name} Booster Pack', type='Booster Pack',
+            market_hash_name=f'{classid}-{name} Booster Pack',
+            marketable=1, tradable=1
+        ))
+    # В описаниях встречаются и другие предметы
+    descriptions.append(dict(
+        appid=753, classid='1', instanceid='0', name='Gems',
+        type='Steam Gems', marketable=0, tradable=0
+    ))
+    result = dict(
+        success=1,
+        total_inventory_count=(
+            len(assets) if total_count is None else total_count
+        ),
+        assets=assets,
+        descriptions=descriptions,
+    )
+    if last_assetid is not None:
+        result.update(more_items=1, last_assetid=str(last_assetid))
+    return result
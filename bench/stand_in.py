@@ -0,0 +1,207 @@
+"""
+Локальная замена steamcommunity.com для бенчмарков.
+Отдает сгенерированные ответы (bench.fixtures) с настраиваемой задержкой
+и считает запросы к каждому адресу
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from bench import fixtures
+
+
+class SteamStandIn:
+    """Сервер, который изображает Steam для одного пользователя"""
+
+    USERNAME = 'benchuser'
+    STEAM_ID = '76561190000000000'
+    GEM_POUCH_ITEM_ID = 26463978
+    # Цена мешка самоцветов (в копейках)
+    POUCH_SELL, POUCH_BUY = 30500, 30000
+    # Размер страницы инвентаря, если count не указан
+    INVENTORY_PAGE_SIZE = 75
+
+    def __init__(self, bundles_count: int = 400, latency: float = 0.,
+                 gems_amount: int = 20000, min_margin: int = 250,
+                 seed: int = 0, error_rate: float = 0.):
+        """
+        :param bundles_count: количество игр на странице создания наборов
+        :param latency: задержка каждого ответа (в секундах)
+        :param gems_amount: самоцветов у пользователя на старте
+        :param min_margin: минимальная маржа бота, чтобы часть наборов
+                           оказалась рентабельной
+        :param error_rate: доля запросов к торговой площадке, на которые
+                           отвечается 503 или 429 с Retry-After
+        """
+        self.latency = latency
+        self.bundles_count = bundles_count
+        self.gems_amount = gems_amount
+        self.seed = seed
+        self.error_rate = error_rate
+        self.errors_random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        rnd = random.Random(seed)
+        page = fixtures.booster_creator_page(bundles_count, seed=seed)
+        start = page.index(b'[{')
+        self.bundles, _ = json.JSONDecoder().raw_decode(page[start:].decode())
+        # Цены наборов: (минимальная цена продажи, максимальная покупки)
+        self.prices = {}
+        for bundle in self.bundles:
+            if rnd.random() < .1:
+                # Набор никто не продает
+                self.prices[bundle['appid']] = (None, None)
+                continue
+            bundles_per_pouch = 1000 / int(bundle['price'])
+            break_even = (self.POUCH_BUY + min_margin) / bundles_per_pouch
+            buy = round(break_even * rnd.uniform(.7, 1.15))
+            self.prices[bundle['appid']] = (round(buy * 1.15), buy)
+        # Инвентарь: по несколько наборов части игр
+        self.inventory = []
+        for bundle in rnd.sample(self.bundles, max(bundles_count // 20, 1)):
+            for _ in range(rnd.randint(1, 3)):
+                assetid = 10 ** 10 + len(self.inventory)
+                self.inventory.append(
+                    (assetid, bundle['appid'], bundle['name'])
+                )
+        self.by_name = {x['name']: x for x in self.bundles}
+        self.server = None
+
+    def start(self):
+        """Запуск сервера в фоне. Возвращает базовый адрес"""
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.handle(self, 'GET')
+
+            def do_POST(self):
+                stand_in.handle(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def take_counts(self):
+        """Счетчики запросов с момента прошлого вызова"""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def handle(self, request, method):
+        parts = urlsplit(request.path)
+        path = '/' + '/'.join(x for x in unquote(parts.path).split('/') if x)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if method == 'POST':
+            length = int(request.headers.get('Content-Length', 0))
+            body = request.rfile.read(length).decode()
+            query.update({k: v[0] for k, v in parse_qs(body).items()})
+        endpoint, status, content_type, body = self.route(path, query)
+        headers = {}
+        with self.lock:
+            is_error = (
+                path.startswith('/market/')
+                and self.errors_random.random() < self.error_rate
+            )
+            if is_error:
+                status = self.errors_random.choice((429, 503))
+                endpoint, body = f'{endpoint} ({status})', b''
+                if status == 429:
+                    headers['Retry-After'] = '1'
+            self.counts[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def route(self, path, query):
+        """Ответ на запрос: (адрес для статистики, код, тип, тело)"""
+        html, js = 'text/html; charset=UTF-8', 'application/json'
+        if path == '/tradingcards/boostercreator':
+            page = fixtures.booster_creator_page(
+                self.bundles_count, gems_amount=self.gems_amount,
+                username=self.USERNAME, seed=self.seed
+            )
+            return 'boostercreator', 200, html, page
+        if path == '/tradingcards/ajaxcreatebooster':
+            bundle = next(
+                x for x in self.bundles if str(x['appid']) == query['appid']
+            )
+            with self.lock:
+                self.gems_amount -= int(bundle['price'])
+                result = dict(
+                    purchase_result=dict(success=1, appid=bundle['appid']),
+                    goo_amount=str(self.gems_amount)
+                )
+            return 'ajaxcreatebooster', 200, js, self.dumps(result)
+        if path == '/market/search/render':
+            listed = [x for x in self.bundles if self.prices[x['appid']][0]]
+            start, count = int(query['start']), int(query['count'])
+            page = fixtures.market_search_render(
+                [
+                    (x['appid'], x['name'], self.prices[x['appid']][0])
+                    for x in listed[start:start + min(count, 100)]
+                ],
+                start=start, total_count=len(listed)
+            )
+            return 'market/search/render', 200, js, self.dumps(page)
+        if path == '/market/search':
+            name = query.get('q', '').replace('Booster Pack', '').strip()
+            results = [
+                (753, f'{x["appid"]}-{x["name"]} Booster Pack')
+                for x in self.bundles
+                if name and name in x['name'] and self.prices[x['appid']][0]
+            ]
+            page = fixtures.market_search_page(results)
+            return 'market/search', 200, html, page
+        if path.startswith('/market/listings/'):
+            appid = int(path.split('/')[-1].split('-')[0])
+            page = fixtures.market_listing_page(appid)
+            return 'market/listings', 200, html, page
+        if path == '/market/itemordershistogram':
+            item_nameid = int(query['item_nameid'])
+            if item_nameid == self.GEM_POUCH_ITEM_ID:
+                prices = self.POUCH_SELL, self.POUCH_BUY
+            else:
+                prices = self.prices.get(item_nameid, (None, None))
+            result = fixtures.order_histogram(*prices)
+            return 'itemordershistogram', 200, js, self.dumps(result)
+        if path == f'/id/{self.USERNAME}/inventory':
+            page = fixtures.inventory_page(self.STEAM_ID, self.USERNAME)
+            return 'id/inventory', 200, html, page
+        if path.startswith(f'/inventory/{self.STEAM_ID}/'):
+            start_assetid = int(query.get('start_assetid', 0))
+            count = int(query.get('count', self.INVENTORY_PAGE_SIZE))
+            rest = [x for x in self.inventory if x[0] > start_assetid]
+            page, more = rest[:count], len(rest) > count
+            result = fixtures.inventory(
+                page, total_count=len(self.inventory),
+                last_assetid=page[-1][0] if more else None
+            )
+            return 'inventory', 200, js, self.dumps(result)
+        if path == '/market/sellitem':
+            return 'sellitem', 200, js, self.dumps(dict(success=True))
+        return 'unknown', 404, html, b''
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
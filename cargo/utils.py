@@ -5,6 +5,7 @@ import pickle
 import random
 import sys
 import threading
+import time
 import traceback
 
 
@@ -31,11 +32,15 @@ class Commonly:
         return ''
 
     @staticmethod
-    def process(func):
-        """ Декоратор для запуска функций в процессе исполнения """
+    def process(func, context=None):
+        """
+        Декоратор для запуска функций в процессе исполнения
+        :param context: контекст multiprocessing (по умолчанию - системный)
+        """
+        context = context or multiprocessing
 
         def run(*args, **kwargs):
-            target = multiprocessing.Process(
+            target = context.Process(
                 target=func, args=args, kwargs=kwargs
             )
             target.start()
@@ -140,3 +145,40 @@ class RequestsUtils:
                 ua_list if ua_list else cls._load_user_agent_list()
             )
         }
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов по алгоритму token bucket.
+    Один экземпляр может разделяться между любым количеством потоков
+    """
+
+    def __init__(self, per_minute: int, burst: int = 1):
+        """
+        :param per_minute: допустимое количество запросов в минуту
+                           (0 - без ограничений)
+        :param burst: сколько запросов можно сделать подряд без ожидания
+        """
+        self.rate = per_minute / 60
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Блокирует поток, пока не освободится токен на запрос """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,227 @@
+import hashlib
+import math
+from array import array
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+
+class Bundle:
+    """Набор карточек со страницы создания наборов"""
+
+    __slots__ = ('appid', 'name', 'series', 'price', 'unavailable',
+                 'available_at')
+
+    def __init__(self, appid: int, name: str, series: int, price: int,
+                 unavailable: bool = False, available_at: float = None):
+        """
+        :param price: стоимость крафта в самоцветах
+        :param unavailable: набор уже создавался недавно
+        :param available_at: когда набор снова можно создать (timestamp)
+        """
+        self.appid = appid
+        self.name = name
+        self.series = series
+        self.price = price
+        self.unavailable = unavailable
+        self.available_at = available_at
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Набор из данных CBoosterCreatorPage.Init (все поля - строки)"""
+        return cls(
+            appid=int(data['appid']),
+            name=data['name'],
+            series=int(data.get('series', 1)),
+            price=int(data['price']),
+            unavailable=bool(data.get('unavailable')),
+            available_at=cls.parse_available_at(
+                data.get('available_at_time')
+            )
+        )
+
+    @staticmethod
+    def parse_available_at(value: str):
+        """
+        Время доступности набора вида '14 Nov @ 6:49pm' (без года)
+        :return: timestamp или None
+        """
+        if not value:
+            return None
+        try:
+            moment = parse(value.replace('@', ''))
+        except (ValueError, OverflowError):
+            return None
+        # Год не указан: дата в прошлом относится к следующему году
+        if moment < datetime.now() - timedelta(days=1):
+            moment = moment.replace(year=moment.year + 1)
+        return moment.timestamp()
+
+    def __repr__(self):
+        return (
+            f'Bundle(appid={self.appid}, name={self.name!r}, '
+            f'price={self.price}, unavailable={self.unavailable})'
+        )
+
+
+class BundleDiff:
+    """Изменения списка наборов с прошлого цикла (списки имен)"""
+
+    __slots__ = ('added', 'removed', 'repriced', 'availability')
+
+    def __init__(self, added=(), removed=(), repriced=(), availability=()):
+        """
+        :param repriced: изменилась стоимость крафта
+        :param availability: набор стал доступен или недоступен для крафта
+        """
+        self.added = list(added)
+        self.removed = list(removed)
+        self.repriced = list(repriced)
+        self.availability = list(availability)
+
+    def __bool__(self):
+        return bool(
+            self.added or self.removed or self.repriced or self.availability
+        )
+
+    def __str__(self):
+        return (
+            f'новых {len(self.added)}, исчезло {len(self.removed)}, '
+            f'сменили цену {len(self.repriced)}, '
+            f'сменили доступность {len(self.availability)}'
+        )
+
+
+class BundleTable(Mapping):
+    """
+    Компактная таблица наборов: поля хранятся по колонкам в массивах,
+    а Bundle создается только при обращении к набору.
+    Работает как словарь {имя набора: Bundle}, плюс поиск по appid
+    """
+
+    def __init__(self, bundles=()):
+        self._appids = array('q')
+        self._series = array('h')
+        self._prices = array('l')
+        self._unavailable = array('b')
+        self._available_at = array('d')
+        self._names = []
+        self._by_name = {}
+        self._by_appid = {}
+        for bundle in bundles:
+            self.append(bundle)
+
+    @classmethod
+    def from_dicts(cls, bundles):
+        return cls(Bundle.from_dict(x) for x in bundles)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Таблица из строк to_rows (например, сохраненных в БД)"""
+        return cls(Bundle(*row) for row in rows)
+
+    def to_rows(self):
+        """Наборы списками полей в порядке Bundle.__slots__"""
+        return [
+            [getattr(bundle, x) for x in Bundle.__slots__]
+            for bundle in self.values()
+        ]
+
+    def append(self, bundle: Bundle):
+        index = len(self._names)
+        self._appids.append(bundle.appid)
+        self._series.append(bundle.series)
+        self._prices.append(bundle.price)
+        self._unavailable.append(bundle.unavailable)
+        self._available_at.append(
+            math.nan if bundle.available_at is None else bundle.available_at
+        )
+        self._names.append(bundle.name)
+        self._by_name[bundle.name] = index
+        self._by_appid[bundle.appid] = index
+
+    def fingerprint(self):
+        """
+        Снимок для сравнения со следующим циклом:
+        {имя набора: [стоимость крафта, недоступен]}
+        """
+        return {
+            name: [self._prices[index], bool(self._unavailable[index])]
+            for name, index in self._by_name.items()
+        }
+
+    def digest(self):
+        """Хэш снимка: совпадает, только если наборы не менялись"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update('\0'.join(self._names).encode('utf-8'))
+        digest.update(self._prices.tobytes())
+        digest.update(self._unavailable.tobytes())
+        return digest.hexdigest()
+
+    def diff(self, previous: dict):
+        """
+        Изменения относительно прошлого снимка (см. fingerprint)
+        :return: BundleDiff
+        """
+        result = BundleDiff(
+            removed=[x for x in previous if x not in self._by_name]
+        )
+        for name, index in self._by_name.items():
+            if name not in previous:
+                result.added.append(name)
+                continue
+            price, unavailable = previous[name]
+            if price != self._prices[index]:
+                result.repriced.append(name)
+            if unavailable != bool(self._unavailable[index]):
+                result.availability.append(name)
+        return result
+
+    def filter(self, predicate):
+        """Новая таблица из наборов, подходящих под условие"""
+        return BundleTable(x for x in self.values() if predicate(x))
+
+    def by_appid(self, appid):
+        """Набор по appid или None"""
+        index = self._by_appid.get(int(appid))
+        return None if index is None else self._make(index)
+
+    def set_unavailable(self, name: str, available_at: float = None):
+        """Набор только что создан: следующий - не раньше чем через сутки"""
+        index = self._by_name[name]
+        self._unavailable[index] = True
+        self._available_at[index] = (
+            math.nan if available_at is None else available_at
+        )
+
+    @property
+    def prices(self):
+        """Стоимость крафта всех наборов в порядке таблицы"""
+        return self._prices
+
+    def _make(self, index: int):
+        available_at = self._available_at[index]
+        return Bundle(
+            appid=self._appids[index],
+            name=self._names[index],
+            series=self._series[index],
+            price=self._prices[index],
+            unavailable=bool(self._unavailable[index]),
+            available_at=None if math.isnan(available_at) else available_at
+        )
+
+    def __getitem__(self, name: str):
+        return self._make(self._by_name[name])
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def values(self):
+        return (self._make(x) for x in range(len(self._names)))
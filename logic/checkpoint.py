@@ -0,0 +1,111 @@
+import time
+
+
+class CycleCheckpoint:
+    """
+    Состояние текущего цикла на диске, чтобы после ошибки или перезапуска
+    продолжить с того же места: этап цикла, цена мешка, уже собранные
+    цены наборов, разобранная страница наборов и сделанные крафты.
+    Состояние старше max_age считается устаревшим и сбрасывается
+    """
+
+    # Сектор хранилища с состоянием цикла
+    STATE = 'CHECKPOINT'
+    # Сектор с ценами, собранными за цикл (запись на каждый набор)
+    PRICES = 'CHECKPOINT_PRICES'
+    PHASES = ('profitability', 'craft', 'sell')
+
+    def __init__(self, storage, max_age: float):
+        """
+        :param storage: хранилище аккаунта
+        :param max_age: сколько секунд состояние цикла актуально
+        """
+        self.storage = storage
+        self.max_age = max_age
+        self.state = self.storage.get_sector(self.STATE)
+        cycle = self.state.get('cycle')
+        self.resumed = bool(
+            cycle and time.time() - cycle['started'] < self.max_age
+        )
+        if not self.resumed:
+            self.state = {}
+
+    def begin(self):
+        """Начало цикла: старое состояние сбрасывается, если не актуально"""
+        if self.resumed:
+            return
+        self.clear()
+        self._write('cycle', dict(started=time.time(), phase=None))
+
+    def finish(self):
+        """Цикл завершен, продолжать нечего"""
+        self.clear()
+        self.resumed = False
+
+    def clear(self):
+        self.storage.clear(self.STATE)
+        self.storage.clear(self.PRICES)
+        self.state = {}
+
+    @property
+    def phase(self):
+        return self.state.get('cycle', {}).get('phase')
+
+    def set_phase(self, phase: str):
+        self._write('cycle', dict(self.state['cycle'], phase=phase))
+
+    def is_passed(self, phase: str):
+        """Этап уже пройден в прерванном цикле"""
+        if self.phase is None:
+            return False
+        return self.PHASES.index(phase) < self.PHASES.index(self.phase)
+
+    def get_pouch_price(self):
+        return self.state.get('pouch_price')
+
+    def set_pouch_price(self, price):
+        self._write('pouch_price', price)
+
+    def get_prices(self):
+        """Собранные за цикл цены: {имя набора: (продажа, покупка)}"""
+        if not self.resumed:
+            return {}
+        return {
+            name: tuple(prices)
+            for name, prices in self.storage.get_sector(self.PRICES).items()
+        }
+
+    def add_prices(self, name: str, prices):
+        self.storage.write({name: list(prices)}, self.PRICES)
+
+    def get_page(self):
+        """
+        Сохраненная страница наборов с учетом крафтов, сделанных после
+        ее загрузки
+        :return: состояние для BoosterCreatorPage.from_state или None
+        """
+        page = self.state.get('page')
+        if not page:
+            return None
+        crafted = self.state.get('crafted')
+        if crafted:
+            page = dict(
+                page, gems_amount=crafted['gems_amount'],
+                crafted=crafted['names']
+            )
+        return page
+
+    def set_page(self, page_state: dict):
+        """Страница загружена заново: прежние крафты в ней уже учтены"""
+        self._write('page', page_state)
+        self._write('crafted', None)
+
+    def add_crafted(self, name: str, gems_amount: int):
+        crafted = self.state.get('crafted') or dict(names=[])
+        self._write('crafted', dict(
+            names=crafted['names'] + [name], gems_amount=gems_amount
+        ))
+
+    def _write(self, key: str, value):
+        self.state[key] = value
+        self.storage.write({key: value}, self.STATE)
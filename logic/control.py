@@ -0,0 +1,306 @@
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import Request, urlopen
+
+import settings
+from cargo.utils import Commonly
+from logic.storage import Storage, StatsStorage
+
+error_logger = logging.getLogger("error_logger")
+
+
+class AccountState:
+    """Состояние одного аккаунта в памяти: его видит API управления"""
+
+    def __init__(self):
+        self.fields = dict(phase=None, cycle=0, paused=False)
+        self.rescan = False
+        # Сколько раз запрашивалась полная проверка
+        self.rescans = 0
+        # Будит аккаунт из сна между циклами и после паузы
+        self.wake = threading.Condition()
+
+
+class Control:
+    """
+    API управления ботом на localhost (порт CONTROL_PORT).
+    GET /status - статистика из памяти, этап цикла, ход проверки,
+    рентабельные наборы и самоцветы каждого аккаунта;
+    POST /rescan, /pause, /resume (?account=<имя>, без него - все аккаунты).
+    Бот ничего не читает с диска ради ответа, поэтому show_stats.py
+    не мешает работе бота.
+    Каждый запрос несет токен из файла TOKEN_FILE в папке БД
+    в заголовке TOKEN_HEADER. Запросы с заголовком Origin (из браузера)
+    и с чужим Host отклоняются: страницы, открытые в браузере,
+    не могут управлять ботом
+    """
+
+    HOST = '127.0.0.1'
+    PORT = settings.CONTROL_PORT
+    # Имя аккаунта в режиме одного аккаунта (settings.COOKIES)
+    DEFAULT_ACCOUNT = 'default'
+    COMMANDS = ('rescan', 'pause', 'resume')
+    TOKEN_FILE = 'control_token'
+    TOKEN_HEADER = 'X-Control-Token'
+
+    _states = {}
+    _lock = threading.Lock()
+    _started = False
+    _token = None
+
+    @classmethod
+    def update(cls, account=None, **fields):
+        """Обновление полей состояния аккаунта"""
+        state = cls._get_state(account)
+        with cls._lock:
+            state.fields.update(fields)
+
+    @classmethod
+    def set_good_bundle(cls, account, name: str, margin: int):
+        """Рентабельный набор для рейтинга в статусе"""
+        state = cls._get_state(account)
+        with cls._lock:
+            state.fields.setdefault('good_bundles', {})[name] = margin
+
+    @classmethod
+    def command(cls, name: str, account=None):
+        """
+        Выполнение команды управления
+        :param account: None - для всех аккаунтов
+        :return: аккаунты, к которым применена команда
+        """
+        if name not in cls.COMMANDS:
+            raise ValueError(f'Неизвестная команда: {name}')
+        with cls._lock:
+            if account is None:
+                states = dict(cls._states)
+            elif cls._key(account) in cls._states:
+                states = {account: cls._states[cls._key(account)]}
+            else:
+                states = {}
+        for state in states.values():
+            with state.wake:
+                if name == 'rescan':
+                    state.rescan = True
+                    state.rescans += 1
+                else:
+                    state.fields['paused'] = name == 'pause'
+                state.wake.notify_all()
+        return sorted(states)
+
+    @classmethod
+    def take_rescan(cls, account=None):
+        """Запрошена ли полная проверка (запрос снимается)"""
+        state = cls._get_state(account)
+        with state.wake:
+            rescan, state.rescan = state.rescan, False
+        return rescan
+
+    @classmethod
+    def sleep(cls, seconds: float, account=None, new_rescan_only=False):
+        """
+        Сон между циклами. Команда rescan будит аккаунт сразу,
+        а на паузе он спит, пока его не возобновят
+        :param new_rescan_only: будит только rescan, пришедший во время
+                                сна (паузы перед повтором запроса
+                                не пропускаются из-за уже ждущей проверки)
+        """
+        state = cls._get_state(account)
+        deadline = time.monotonic() + seconds
+        with state.wake:
+            rescans = state.rescans
+            while not (
+                state.rescans != rescans
+                or state.rescan and not new_rescan_only
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not state.fields['paused']:
+                    break
+                state.wake.wait(
+                    None if state.fields['paused'] else remaining
+                )
+
+    @classmethod
+    def is_paused(cls, account=None):
+        """Стоит ли аккаунт на паузе"""
+        state = cls._get_state(account)
+        with state.wake:
+            return state.fields['paused']
+
+    @classmethod
+    def wait_if_paused(cls, account=None):
+        """Ожидание снятия паузы (между этапами и запросами проверки)"""
+        state = cls._get_state(account)
+        with state.wake:
+            while state.fields['paused']:
+                state.wake.wait()
+
+    @classmethod
+    def status(cls):
+        """
+        Состояние всех аккаунтов: статистика, этап цикла, ход проверки,
+        самоцветы и рентабельные наборы от самого выгодного
+        """
+        with cls._lock:
+            states = {
+                key: dict(state.fields) for key, state in cls._states.items()
+            }
+        for key, fields in states.items():
+            account = None if key == cls.DEFAULT_ACCOUNT else key
+            fields['stats'] = StatsStorage.for_account(account).get_totals()
+            good_bundles = fields.pop('good_bundles', {})
+            fields['good_bundles'] = sorted(
+                ([name, margin] for name, margin in good_bundles.items()),
+                key=lambda x: x[1], reverse=True
+            )
+        return dict(accounts=states)
+
+    @classmethod
+    def start(cls, port: int = None):
+        """
+        Запуск API управления (один раз на процесс)
+        :param port: порт на localhost (0 - не запускать)
+        :return: True, если сервер запущен
+        """
+        with cls._lock:
+            if cls._started:
+                return True
+            cls._started = True
+        port = cls.PORT if port is None else port
+        if not port:
+            return False
+        try:
+            cls._token = cls.get_token(create=True)
+            server = ThreadingHTTPServer((cls.HOST, port), cls._make_handler())
+        except OSError as error:
+            # Порт занят, например, другим экземпляром бота
+            error_logger.error(f'API управления не запущено: {error}')
+            return False
+        server.daemon_threads = True
+        Commonly.thread(server.serve_forever)()
+        return True
+
+    @classmethod
+    def request(cls, path: str, method: str = 'GET', port: int = None,
+                timeout: float = 2):
+        """
+        Запрос к API управления работающего бота (для show_stats.py)
+        :return: ответ (словарь) или None, если бот не отвечает
+        """
+        port = cls.PORT if port is None else port
+        token = cls.get_token()
+        if not port or not token:
+            return None
+        request = Request(
+            f'http://{cls.HOST}:{port}{path}', method=method,
+            data=b'{}' if method == 'POST' else None,
+            headers={
+                cls.TOKEN_HEADER: token, 'Content-Type': 'application/json'
+            }
+        )
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except (URLError, OSError, ValueError):
+            return None
+
+    @classmethod
+    def get_token(cls, create=False):
+        """
+        Токен API управления из папки БД
+        :param create: создать новый токен (при запуске API)
+        :return: токен или None, если его нет
+        """
+        path = os.path.join(Storage.FOLDER_PATH, cls.TOKEN_FILE)
+        if create:
+            token = secrets.token_hex(16)
+            # Файл читает только владелец
+            descriptor = os.open(
+                path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(token)
+            return token
+        try:
+            with open(path) as file:
+                return file.read().strip() or None
+        except OSError:
+            return None
+
+    @classmethod
+    def _is_allowed(cls, headers, port: int):
+        """Запрос от show_stats.py, а не со страницы в браузере"""
+        if headers.get('Origin') is not None:
+            return False
+        if headers.get('Host') not in (
+                f'{cls.HOST}:{port}', f'localhost:{port}'):
+            return False
+        token = headers.get(cls.TOKEN_HEADER) or ''
+        return bool(cls._token) and hmac.compare_digest(
+            token.encode(), cls._token.encode()
+        )
+
+    @classmethod
+    def _get_state(cls, account):
+        with cls._lock:
+            return cls._states.setdefault(cls._key(account), AccountState())
+
+    @classmethod
+    def _key(cls, account):
+        return account or cls.DEFAULT_ACCOUNT
+
+    @classmethod
+    def _make_handler(cls):
+        control = cls
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if not self._check_access():
+                    return
+                if urlsplit(self.path).path != '/status':
+                    self.send_error(404)
+                    return
+                self._send_json(control.status())
+
+            def do_POST(self):
+                if not self._check_access():
+                    return
+                url = urlsplit(self.path)
+                name = url.path.strip('/')
+                if name not in control.COMMANDS:
+                    self.send_error(404)
+                    return
+                account = parse_qs(url.query).get('account', [None])[0]
+                accounts = control.command(name, account)
+                self._send_json(dict(command=name, accounts=accounts))
+
+            def _check_access(self):
+                port = self.server.server_address[1]
+                if control._is_allowed(self.headers, port):
+                    return True
+                self.send_error(403)
+                return False
+
+            def _send_json(self, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'application/json; charset=utf-8'
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class Evaluation:
+    """Результат расчета рентабельности пачки наборов"""
+
+    __slots__ = (
+        'margins', 'no_sellers', 'no_buyers', 'good', 'bad', 'ranking'
+    )
+
+    def __init__(self, margins, no_sellers, no_buyers, good, bad, ranking):
+        # Маржа с мешка самоцветов (nan - цену посчитать нельзя)
+        self.margins = margins
+        # Набор никто не продает, значит и нам его не продать
+        self.no_sellers = no_sellers
+        # Нет лотов на покупку
+        self.no_buyers = no_buyers
+        self.good = good
+        self.bad = bad
+        # Индексы рентабельных наборов от самого выгодного
+        self.ranking = ranking
+
+
+class ProfitabilityEngine:
+    """
+    Векторный расчет рентабельности наборов.
+    Цены собираются отдельно, а маржа, рейтинг и деление на рентабельные
+    и нерентабельные наборы считаются за один проход NumPy
+    """
+
+    # Самоцветов в мешке
+    POUCH_GEMS = 1000
+    # Маржа, которая записывается наборам, которые никто не продает
+    NO_SELLERS_MARGIN = -1000
+
+    @classmethod
+    def evaluate(cls, gems_prices, sell_prices, buy_prices,
+                 pouch_price: int, min_margin: int):
+        """
+        Расчет рентабельности наборов
+        :param gems_prices: стоимость крафта наборов в самоцветах
+        :param sell_prices: минимальные цены продажи (None - нет лотов)
+        :param buy_prices: максимальные цены покупки (None - нет лотов)
+        :param pouch_price: цена мешка самоцветов
+        :param min_margin: минимальная маржа рентабельного набора
+        :return: Evaluation
+        """
+        income = cls.get_income_per_pouch(gems_prices, buy_prices)
+        no_sellers = np.isnan(cls._to_array(sell_prices))
+        no_buyers = ~no_sellers & np.isnan(income)
+        margins = income - pouch_price
+        margins[no_sellers] = cls.NO_SELLERS_MARGIN
+        good = margins > min_margin
+        bad = ~good & ~no_buyers
+        good_indexes = np.flatnonzero(good)
+        ranking = good_indexes[np.argsort(-margins[good], kind='stable')]
+        return Evaluation(margins, no_sellers, no_buyers, good, bad, ranking)
+
+    @classmethod
+    def sweep(cls, gems_prices, sell_prices, buy_prices,
+              pouch_prices, min_margins):
+        """
+        Расчет "что, если" сразу для нескольких цен мешка и порогов маржи
+        :return: (маржи формы [цена мешка, набор],
+                  признаки рентабельности формы [цена мешка, порог, набор])
+        """
+        income = cls.get_income_per_pouch(gems_prices, buy_prices)
+        income[np.isnan(cls._to_array(sell_prices))] = np.nan
+        pouch_prices = np.asarray(pouch_prices, dtype=float)
+        min_margins = np.asarray(min_margins, dtype=float)
+        margins = income[np.newaxis, :] - pouch_prices[:, np.newaxis]
+        good = (
+            margins[:, np.newaxis, :]
+            > min_margins[np.newaxis, :, np.newaxis]
+        )
+        return margins, good
+
+    @classmethod
+    def get_income_per_pouch(cls, gems_prices, buy_prices):
+        """Выручка от продажи наборов, созданных из одного мешка"""
+        bundles_count = cls.POUCH_GEMS / np.asarray(gems_prices, dtype=float)
+        # Округление как у round(): к ближайшему четному
+        return np.round(bundles_count * cls._to_array(buy_prices))
+
+    @staticmethod
+    def _to_array(prices):
+        """Цены в массив, где отсутствующая цена - nan"""
+        return np.array(
+            [price or np.nan for price in prices], dtype=float
+        )
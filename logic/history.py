@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from logic.storage import Storage
+
+
+class PriceHistory:
+    """
+    История цен предметов торговой площадки.
+    Каждый ответ itemordershistogram дописывается в конец двоичного файла
+    записью фиксированной длины, а чтение идет через np.memmap, поэтому
+    выборки по всей истории считаются локально за миллисекунды.
+    Отсутствующая цена хранится как 0 и в выборках становится nan
+    """
+
+    PATH = os.path.join(Storage.FOLDER_PATH, 'price_history.bin')
+    DTYPE = np.dtype([
+        ('ts', '<f8'),
+        ('item_nameid', '<i8'),
+        ('sell', '<i4'),
+        ('buy', '<i4'),
+        ('sell_count', '<i4'),
+        ('buy_count', '<i4'),
+    ])
+    _lock = threading.Lock()
+
+    @classmethod
+    def append(cls, item_nameid, sell_price, buy_price,
+               sell_count=0, buy_count=0, ts: float = None):
+        """Запись одного наблюдения цены"""
+        record = np.array(
+            [(
+                ts or time.time(), int(item_nameid),
+                sell_price or 0, buy_price or 0,
+                cls.parse_count(sell_count), cls.parse_count(buy_count)
+            )],
+            dtype=cls.DTYPE
+        )
+        with cls._lock:
+            with open(cls.PATH, 'ab') as file:
+                file.write(record.tobytes())
+
+    @classmethod
+    def append_histogram(cls, item_nameid, response: dict):
+        """Запись ответа itemordershistogram"""
+        sell_price = response.get('lowest_sell_order')
+        buy_price = response.get('highest_buy_order')
+        cls.append(
+            item_nameid,
+            int(sell_price) if sell_price else None,
+            int(buy_price) if buy_price else None,
+            response.get('sell_order_count'),
+            response.get('buy_order_count')
+        )
+
+    @classmethod
+    def read(cls):
+        """
+        Вся история как np.memmap: файл не загружается в память целиком,
+        выборки копируют только подходящие записи
+        """
+        with cls._lock:
+            # Недописанная при аварии запись отбрасывается
+            size = os.path.getsize(cls.PATH) if os.path.exists(cls.PATH) else 0
+            count = size // cls.DTYPE.itemsize
+            if not count:
+                return np.empty(0, dtype=cls.DTYPE)
+            return np.memmap(
+                cls.PATH, dtype=cls.DTYPE, mode='r', shape=(count,)
+            )
+
+    @classmethod
+    def series(cls, item_nameid, since: float = None, records=None):
+        """
+        Наблюдения одного предмета по времени
+        :param since: начиная с момента (timestamp)
+        :return: (время, цена продажи, цена покупки) - массивы float
+        """
+        records = cls.read() if records is None else records
+        mask = records['item_nameid'] == int(item_nameid)
+        if since is not None:
+            mask &= records['ts'] >= since
+        selected = records[mask]
+        return (
+            selected['ts'],
+            cls._to_prices(selected['sell']),
+            cls._to_prices(selected['buy'])
+        )
+
+    @classmethod
+    def latest(cls, item_nameid, records=None):
+        """
+        Последнее наблюдение предмета
+        :return: (время, цена продажи, цена покупки) или None
+        """
+        ts, sell, buy = cls.series(item_nameid, records=records)
+        if not len(ts):
+            return None
+        last = int(np.argmax(ts))
+        return (
+            float(ts[last]), cls._to_price(sell[last]),
+            cls._to_price(buy[last])
+        )
+
+    @classmethod
+    def window_stats(cls, item_nameid, seconds: float, now: float = None,
+                     records=None):
+        """
+        Минимум, максимум и среднее цен предмета за последние seconds
+        :return: словарь, цены без наблюдений - None
+        """
+        now = now or time.time()
+        ts, sell, buy = cls.series(
+            item_nameid, since=now - seconds, records=records
+        )
+        result = dict(count=len(ts))
+        for name, prices in (('sell', sell), ('buy', buy)):
+            known = prices[~np.isnan(prices)]
+            for func in ('min', 'max', 'mean'):
+                result[f'{func}_{name}'] = (
+                    round(float(getattr(known, func)()))
+                    if len(known) else None
+                )
+        return result
+
+    @classmethod
+    def show_report(cls, items: dict, days: int = 7, logger=None):
+        """
+        Отчет по играм за последние days
+        :param items: {имя набора: данные предмета с item_nameid}
+        """
+        logger = logger or print
+        records = cls.read()
+        if not len(records):
+            logger('История цен пока пуста')
+            return
+        # Дальше нужны только наблюдения за период
+        now = time.time()
+        seconds = days * 24 * 3600
+        records = records[records['ts'] >= now - seconds]
+        logger(f'Цены наборов за {days} дн. (продажа / покупка, руб.):')
+        for name in sorted(items):
+            item_nameid = items[name].get('item_nameid')
+            if not item_nameid:
+                continue
+            stats = cls.window_stats(
+                item_nameid, seconds, now=now, records=records
+            )
+            if not stats['count']:
+                continue
+            _, sell_price, buy_price = cls.latest(item_nameid, records)
+            logger(
+                f'{name}: '
+                f'сейчас {cls._rub(sell_price)} / {cls._rub(buy_price)}; '
+                f'мин. {cls._rub(stats["min_sell"])} / '
+                f'{cls._rub(stats["min_buy"])}; '
+                f'макс. {cls._rub(stats["max_sell"])} / '
+                f'{cls._rub(stats["max_buy"])}; '
+                f'сред. {cls._rub(stats["mean_sell"])} / '
+                f'{cls._rub(stats["mean_buy"])} '
+                f'({stats["count"]} набл.)'
+            )
+
+    @staticmethod
+    def parse_count(value):
+        """Количество лотов: в ответе Steam бывает строкой с разделителями"""
+        if not value:
+            return 0
+        if isinstance(value, int):
+            return value
+        digits = re.sub(r'[^\d]', '', str(value))
+        return int(digits) if digits else 0
+
+    @staticmethod
+    def _to_prices(values):
+        prices = values.astype(float)
+        prices[prices == 0] = np.nan
+        return prices
+
+    @staticmethod
+    def _to_price(value):
+        return None if np.isnan(value) else int(value)
+
+    @staticmethod
+    def _rub(value):
+        return '-' if value is None else f'{value / 100}'
@@ -0,0 +1,120 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import settings
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись лога одной строкой JSON: время, уровень, логгер, сообщение
+    и поля, переданные через extra (набор, маржа, задержка, этап...)
+    """
+
+    FIELDS = ('account', 'phase', 'bundle', 'margin', 'price', 'latency',
+              'endpoint', 'status')
+
+    def format(self, record):
+        data = dict(
+            time=datetime.fromtimestamp(record.created).isoformat(),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+        )
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class Logs:
+    """
+    Настройка логов бота.
+    Логгеры только кладут записи в очередь (QueueHandler), а в консоль
+    и файлы их пишет отдельный поток (QueueListener), поэтому запись
+    логов не задерживает запросы. Файлы ротируются по размеру,
+    а при LOG_JSON_FILE все записи дублируются в формате JSON lines
+    """
+
+    ERRORS_FILE = 'errors_log.txt'
+    SELLS_FILE = 'successful_sells.txt'
+    JSON_FILE = settings.LOG_JSON_FILE
+    MAX_BYTES = settings.LOG_MAX_MEGABYTES * 2 ** 20
+    BACKUP_COUNT = settings.LOG_BACKUP_COUNT
+    FORMAT = '%(asctime)s - %(levelname)s: %(message)s'
+    LOGGERS = ('error_logger', 'info_logger', 'sell_logger')
+
+    _listener = None
+    _handler = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def setup(cls):
+        """Подключение логов (один раз на процесс)"""
+        with cls._lock:
+            if cls._listener:
+                return
+            handlers = [
+                cls._only(
+                    'info_logger',
+                    cls._formatted(logging.StreamHandler(), cls.FORMAT)
+                ),
+                cls._only(
+                    'error_logger',
+                    cls._formatted(cls._file(cls.ERRORS_FILE), cls.FORMAT)
+                ),
+                cls._only(
+                    'sell_logger',
+                    cls._formatted(
+                        cls._file(cls.SELLS_FILE), '%(asctime)s: %(message)s'
+                    )
+                ),
+            ]
+            if cls.JSON_FILE:
+                json_handler = cls._file(cls.JSON_FILE, encoding='utf-8')
+                json_handler.setFormatter(JsonFormatter())
+                handlers.append(json_handler)
+            records = queue.SimpleQueue()
+            cls._handler = QueueHandler(records)
+            for name in cls.LOGGERS:
+                logger = logging.getLogger(name)
+                logger.addHandler(cls._handler)
+                if name != 'error_logger':
+                    logger.setLevel(logging.INFO)
+            cls._listener = QueueListener(records, *handlers)
+            cls._listener.start()
+            # Записи, оставшиеся в очереди, допишутся при выходе
+            atexit.register(cls.stop)
+
+    @classmethod
+    def stop(cls):
+        with cls._lock:
+            if not cls._listener:
+                return
+            for name in cls.LOGGERS:
+                logging.getLogger(name).removeHandler(cls._handler)
+            cls._listener.stop()
+            cls._listener = None
+
+    @classmethod
+    def _file(cls, path: str, encoding: str = None):
+        return RotatingFileHandler(
+            path, maxBytes=cls.MAX_BYTES, backupCount=cls.BACKUP_COUNT,
+            encoding=encoding, delay=True
+        )
+
+    @staticmethod
+    def _formatted(handler, fmt: str):
+        handler.setFormatter(logging.Formatter(fmt))
+        return handler
+
+    @staticmethod
+    def _only(name: str, handler):
+        """Обработчик только для записей одного логгера"""
+        handler.addFilter(logging.Filter(name))
+        return handler
@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from logic.metrics import Metrics
+
+
+class UnknownItemError(ValueError):
+    """
+    Steam ответил, что такого предмета нет: сохраненный item_nameid
+    устарел. Прочие сбои (ответы 429/5xx, не JSON) этой ошибкой
+    не считаются, и идентификатор из-за них не забывается
+    """
+
+
+class QuoteCache:
+    """
+    Общий для всех аккаунтов кэш котировок торговой площадки.
+    Пока котировка свежая, запрос к Steam не делается, а одновременные
+    запросы одной котировки из разных потоков превращаются в один.
+    Свежесть можно задать для каждого места вызова (max_age),
+    а при переполнении вытесняются давно не использованные котировки
+    """
+
+    def __init__(self, ttl: float, max_size: int = 5000):
+        """
+        :param ttl: время жизни котировки по умолчанию (в секундах)
+        :param max_size: сколько котировок хранится (0 - без ограничений)
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._quotes = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch, max_age: float = None, site: str = None):
+        """
+        Котировка из кэша или от Steam
+        :param key: item_nameid предмета
+        :param fetch: функция запроса котировки у Steam
+        :param max_age: допустимый возраст котировки (в секундах),
+                        по умолчанию ttl, 0 - всегда свежая котировка
+        :param site: место вызова (для статистики)
+        """
+        max_age = self.ttl if max_age is None else max_age
+        quote = self._get_fresh(key, max_age)
+        if quote is not None:
+            self._count(True, site)
+            return quote
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Пока ждали, котировку мог получить другой поток
+            quote = self._get_fresh(key, max_age)
+            if quote is not None:
+                self._count(True, site)
+                return quote
+            self._count(False, site)
+            quote = fetch()
+            with self._lock:
+                self._quotes[key] = time.monotonic(), quote
+                self._quotes.move_to_end(key)
+                self._evict()
+            return quote
+
+    def peek(self, key):
+        """Свежая котировка из кэша без запроса к Steam"""
+        return self._get_fresh(key, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self._quotes))
+
+    def _get_fresh(self, key, max_age: float):
+        with self._lock:
+            received, quote = self._quotes.get(key, (0, None))
+            if quote is not None:
+                self._quotes.move_to_end(key)
+        if time.monotonic() - received < max_age:
+            return quote
+        return None
+
+    def _evict(self):
+        """Вытеснение давно не использованных котировок"""
+        while self.max_size and len(self._quotes) > self.max_size:
+            key, _ = self._quotes.popitem(last=False)
+            self._locks.pop(key, None)
+
+    def _count(self, is_hit: bool, site: str):
+        with self._lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        Metrics.inc(
+            'quote_cache_total', result='hit' if is_hit else 'miss', site=site
+        )
+
+
+class BoosterPacksIndex:
+    """
+    Сводка по всем наборам карточек на торговой площадке,
+    собранная постранично из market/search/render
+    """
+
+    SUFFIX = ' Booster Pack'
+    # Поле sell_price сводки всегда в центах USD, поэтому цена берется
+    # из sell_price_text, и только если она в рублях (валюта аккаунта)
+    CURRENCY_MARKERS = ('pуб', 'руб', '₽')
+
+    def __init__(self):
+        # {appid игры: лот}, {имя игры: лот}
+        self.by_appid = {}
+        self.by_name = {}
+        self.total_count = None
+        # Все ли страницы получены: если да, то отсутствие набора
+        # в сводке означает, что его никто не продает
+        self.complete = False
+
+    def add_page(self, results):
+        """Добавление страницы результатов поиска"""
+        for result in results:
+            hash_name = result['hash_name']
+            game_appid, _, game_name = hash_name.partition('-')
+            if not hash_name.endswith(self.SUFFIX):
+                continue
+            listing = dict(
+                appid=str(result['asset_description']['appid']),
+                market_hash_name=hash_name,
+                sell_price=self.parse_price_text(
+                    result.get('sell_price_text')
+                ),
+                sell_listings=result['sell_listings']
+            )
+            self.by_appid[game_appid] = listing
+            self.by_name[game_name[:-len(self.SUFFIX)]] = listing
+
+    def get_sell_price(self, bundle):
+        """
+        Минимальная цена продажи набора по сводке
+        :return: (известна ли цена, цена или None, если никто не продает)
+        """
+        listing = self.by_appid.get(str(bundle.appid))
+        if listing:
+            # Цена в другой валюте не годится для сравнения с маржой
+            return listing['sell_price'] is not None, listing['sell_price']
+        return self.complete, None
+
+    @classmethod
+    def parse_price_text(cls, text):
+        """
+        Цена вида '1 234,56 pуб.' в копейках
+        :return: цена или None, если она не в рублях или не разобрана
+        """
+        if not text or not any(x in text for x in cls.CURRENCY_MARKERS):
+            return None
+        digits = re.sub(r'[^\d,.]', '', text).strip('.,')
+        if ',' in digits:
+            digits = digits.replace('.', '').replace(',', '.')
+        try:
+            return round(float(digits) * 100) or None
+        except ValueError:
+            return None
@@ -0,0 +1,263 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import settings
+from cargo.utils import Commonly
+
+
+class Metrics:
+    """
+    Метрики бота в формате Prometheus.
+    Запросы к Steam учитываются хуком сессии (см. SteamSession.add_hook),
+    этапы цикла - через timer(). Метрики отдаются по HTTP (/metrics)
+    и/или периодически переписываются в файл для textfile-коллектора
+    node_exporter
+    """
+
+    PREFIX = 'steam_crafter_'
+    # Описание и тип каждой метрики
+    DEFINITIONS = {
+        'requests_total': ('counter', 'Запросы к Steam по коду ответа'),
+        'request_seconds': ('histogram', 'Время ответа Steam'),
+        'response_bytes_total': ('counter', 'Получено байт от Steam'),
+        'retries_total': ('counter', 'Повторы запросов по причине'),
+        'throttled_total': ('counter', 'Ответы 429 (Steam ограничил запросы)'),
+        'circuit_open': ('gauge', 'Запросы приостановлены из-за 429'),
+        'phase_seconds': ('histogram', 'Длительность этапов цикла'),
+        'last_phase_seconds': ('gauge', 'Длительность последнего этапа'),
+        'quote_cache_total': (
+            'counter', 'Обращения к кэшу котировок (hit/miss)'
+        ),
+        'bundles_evaluated_total': ('counter', 'Проверено наборов'),
+        'bundles_per_minute': (
+            'gauge', 'Скорость последней проверки наборов (в минуту)'
+        ),
+    }
+    BUCKETS = {
+        'request_seconds': (.05, .1, .25, .5, 1, 2.5, 5, 10),
+        'phase_seconds': (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+    }
+    # Адреса, у которых значимы первые три части пути
+    LONG_ENDPOINTS = ('market/search/render',)
+
+    # {имя: {метки: значение}}, для гистограмм значение -
+    # [счетчики по корзинам, сумма, количество]
+    _values = {}
+    _lock = threading.Lock()
+    _started = False
+
+    @classmethod
+    def inc(cls, name: str, amount=1, **labels):
+        key = cls._labels_key(labels)
+        with cls._lock:
+            series = cls._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    @classmethod
+    def set(cls, name: str, value, **labels):
+        with cls._lock:
+            cls._values.setdefault(name, {})[cls._labels_key(labels)] = value
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels):
+        buckets = cls.BUCKETS[name]
+        key = cls._labels_key(labels)
+        with cls._lock:
+            series = cls._values.setdefault(name, {})
+            histogram = series.setdefault(
+                key, [[0] * (len(buckets) + 1), 0., 0]
+            )
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @classmethod
+    @contextmanager
+    def timer(cls, phase: str, **labels):
+        """Замер длительности этапа цикла"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            cls.observe('phase_seconds', elapsed, phase=phase, **labels)
+            cls.set('last_phase_seconds', elapsed, phase=phase, **labels)
+
+    @classmethod
+    def track_scan(cls, bundles_count: int, seconds: float, **labels):
+        """Учет проверки пачки наборов на рентабельность"""
+        cls.inc('bundles_evaluated_total', bundles_count, **labels)
+        if seconds > 0:
+            cls.set(
+                'bundles_per_minute', bundles_count * 60 / seconds, **labels
+            )
+
+    @classmethod
+    def response_hook(cls, response, *args, **kwargs):
+        """Хук сессии: учет каждого ответа Steam"""
+        endpoint = cls.get_endpoint(response.url)
+        cls.inc(
+            'requests_total', endpoint=endpoint,
+            code=str(response.status_code)
+        )
+        cls.observe(
+            'request_seconds', response.elapsed.total_seconds(),
+            endpoint=endpoint
+        )
+        cls.inc(
+            'response_bytes_total', len(response.content), endpoint=endpoint
+        )
+
+    @classmethod
+    def get_endpoint(cls, url: str):
+        """
+        Адрес запроса без изменяемых частей (имени пользователя,
+        идентификаторов и т.п.), чтобы число серий было ограничено
+        """
+        parts = [x for x in urlsplit(url).path.split('/') if x]
+        # id/<имя>/inventory и profiles/<id>/inventory
+        if parts[:1] in (['id'], ['profiles']):
+            parts = parts[:1] + parts[2:]
+        # inventory/<steam_id>/<app_id>/<context>
+        if parts[:1] == ['inventory']:
+            return 'inventory'
+        long_endpoint = '/'.join(parts[:3])
+        if long_endpoint in cls.LONG_ENDPOINTS:
+            return long_endpoint
+        return '/'.join(parts[:2])
+
+    @classmethod
+    def render(cls):
+        """Все метрики в текстовом формате Prometheus"""
+        with cls._lock:
+            values = {
+                name: {
+                    key: (
+                        [list(value[0])] + value[1:]
+                        if isinstance(value, list) else value
+                    )
+                    for key, value in series.items()
+                }
+                for name, series in cls._values.items()
+            }
+        lines = []
+        for name, (kind, help_text) in cls.DEFINITIONS.items():
+            if name not in values:
+                continue
+            full_name = cls.PREFIX + name
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for key, value in sorted(values[name].items()):
+                if kind == 'histogram':
+                    lines.extend(
+                        cls._render_histogram(full_name, key, *value,
+                                              cls.BUCKETS[name])
+                    )
+                else:
+                    lines.append(
+                        f'{full_name}{cls._format_labels(key)} {value}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def write_textfile(cls, path: str):
+        """Атомарная перезапись файла для node_exporter"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(cls.render())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def start(cls, port: int = None, textfile: str = None,
+              textfile_interval: float = None):
+        """
+        Запуск экспорта метрик (один раз на процесс).
+        По умолчанию параметры берутся из settings
+        :param port: порт /metrics на localhost (0 - не запускать)
+        :param textfile: путь к файлу метрик ('' - не писать)
+        :param textfile_interval: как часто переписывать файл (в секундах)
+        """
+        with cls._lock:
+            if cls._started:
+                return
+            cls._started = True
+        port = settings.METRICS_PORT if port is None else port
+        textfile = settings.METRICS_TEXTFILE if textfile is None else textfile
+        textfile_interval = textfile_interval or settings.METRICS_INTERVAL
+        if port:
+            server = ThreadingHTTPServer(
+                ('127.0.0.1', port), cls._make_handler()
+            )
+            server.daemon_threads = True
+            Commonly.thread(server.serve_forever)()
+        if textfile:
+            Commonly.thread(cls._write_textfile_forever)(
+                textfile, textfile_interval
+            )
+
+    @classmethod
+    def _write_textfile_forever(cls, path: str, interval: float):
+        while True:
+            cls.write_textfile(path)
+            time.sleep(interval)
+
+    @classmethod
+    def _make_handler(cls):
+        metrics = cls
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if urlsplit(self.path).path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8'
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @staticmethod
+    def _render_histogram(name, key, buckets_counts, total, count, buckets):
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ('+Inf',), buckets_counts):
+            cumulative += bucket_count
+            labels = Metrics._format_labels(key + (('le', str(bound)),))
+            lines.append(f'{name}_bucket{labels} {cumulative}')
+        labels = Metrics._format_labels(key)
+        lines.append(f'{name}_sum{labels} {total}')
+        lines.append(f'{name}_count{labels} {count}')
+        return lines
+
+    @staticmethod
+    def _labels_key(labels: dict):
+        return tuple(sorted(
+            (name, str(value)) for name, value in labels.items()
+            if value is not None
+        ))
+
+    @staticmethod
+    def _format_labels(key):
+        if not key:
+            return ''
+        labels = ','.join(
+            '{}="{}"'.format(
+                name, value.replace('\\', '\\\\').replace('"', '\\"')
+            )
+            for name, value in key
+        )
+        return '{' + labels + '}'
@@ -0,0 +1,36 @@
+from cargo.utils import Commonly
+from logic.logs import Logs
+from logic.profiling import CycleProfiler
+from logic.storage import Storage
+from logic.user import SteamUser, info_logger
+
+
+class Orchestrator:
+    """
+    Запуск нескольких аккаунтов в одном процессе.
+    Каждый аккаунт работает в своем потоке со своими самоцветами,
+    инвентарем и хранилищем, а кэш предметов и котировок торговой
+    площадки и ограничитель запросов у всех общие (см. SteamUser)
+    """
+
+    def __init__(self, profiles: dict, user_class=SteamUser):
+        """
+        :param profiles: {имя аккаунта: строка куки}
+        :param user_class: класс пользователя Steam
+        """
+        self.profiles = profiles
+        self.user_class = user_class
+
+    def run(self):
+        """Запуск всех аккаунтов и ожидание их завершения"""
+        Logs.setup()
+        Storage.create_folder_path()
+        self.user_class._load_market_items()
+        CycleProfiler.set_accounts(len(self.profiles))
+        info_logger.info(f'Аккаунтов в работе: {len(self.profiles)}')
+        workers = [
+            Commonly.thread(self.user_class.make_money)(cookies, account)
+            for account, cookies in self.profiles.items()
+        ]
+        for worker in workers:
+            worker.join()
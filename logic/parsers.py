@@ -0,0 +1,139 @@
+import json
+import re
+
+from bs4 import BeautifulSoup
+
+from logic.bundles import BundleTable
+
+
+class BoosterCreatorPage:
+    """
+    Данные страницы создания наборов (tradingcards/boostercreator).
+    Нужные значения достаются напрямую из байтов страницы за один проход,
+    без построения дерева BeautifulSoup и без eval
+    """
+
+    INIT_MARKER = b'CBoosterCreatorPage.Init('
+    GEMS_RE = re.compile(rb'<span[^>]*class="goovalue"[^>]*>([^<]*)<')
+    USERNAME_ANCHOR_RE = re.compile(
+        rb'<a\s[^>]*class="menuitem supernav username"[^>]*>'
+    )
+    HREF_RE = re.compile(rb'href="([^"]*)"')
+
+    def __init__(self, content: bytes):
+        """
+        :param content: тело страницы в байтах
+        :raise ValueError: если на странице нет данных о наборах
+                           (как правило, из-за устаревшей сессии)
+        """
+        # Исходные словари наборов не хранятся: только компактная таблица
+        self.bundles = BundleTable.from_dicts(self.extract_bundles(content))
+        self.gems_amount = self.extract_gems_amount(content)
+        self.username = self.extract_username(content)
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """
+        Страница из сохраненного состояния (см. to_state)
+        :param state: может содержать crafted - наборы, созданные
+                      после загрузки страницы
+        """
+        page = cls.__new__(cls)
+        page.bundles = BundleTable.from_rows(state['bundles'])
+        page.gems_amount = state['gems_amount']
+        page.username = state['username']
+        for name in state.get('crafted', ()):
+            if name in page.bundles:
+                page.bundles.set_unavailable(name)
+        return page
+
+    def to_state(self):
+        return dict(
+            bundles=self.bundles.to_rows(),
+            gems_amount=self.gems_amount,
+            username=self.username
+        )
+
+    @classmethod
+    def extract_bundles(cls, content: bytes):
+        """Список наборов из первого аргумента CBoosterCreatorPage.Init"""
+        start = content.find(cls.INIT_MARKER)
+        if start == -1:
+            raise ValueError('На странице нет CBoosterCreatorPage.Init')
+        payload = content[start + len(cls.INIT_MARKER):].decode(
+            'utf-8', errors='replace'
+        )
+        bundles, _ = json.JSONDecoder().raw_decode(payload.lstrip())
+        return bundles
+
+    @classmethod
+    def extract_gems_amount(cls, content: bytes):
+        """Количество самоцветов пользователя"""
+        match = cls.GEMS_RE.search(content)
+        if not match:
+            return None
+        return int(re.sub(rb'[^\d]', b'', match.group(1)))
+
+    @classmethod
+    def extract_username(cls, content: bytes):
+        """Имя пользователя из ссылки на профиль вида /id/<имя>/"""
+        anchor = cls.USERNAME_ANCHOR_RE.search(content)
+        if not anchor:
+            return None
+        href = cls.HREF_RE.search(anchor.group())
+        if not href:
+            return None
+        url_elements = href.group(1).decode().split('/')
+        for num, elem in enumerate(url_elements[:-1]):
+            if elem == 'id':
+                return url_elements[num + 1]
+        return None
+
+
+class MarketPages:
+    """
+    Разбор страниц торговой площадки: поиска (атрибуты предмета)
+    и страницы предмета (item_nameid для запроса цен).
+    Методы не зависят от сессии, поэтому выполняются и в процессах
+    конвейера проверки (см. logic.pipeline)
+    """
+
+    SEARCH_CLASS = (
+        "market_listing_row "
+        "market_recent_listing_row "
+        "market_listing_searchresult"
+    )
+    ORDER_SPREAD = 'Market_LoadOrderSpread'
+
+    @classmethod
+    def extract_search_item(cls, content: bytes, name: str):
+        """
+        Предмет из результатов поиска
+        :return: {'data-appid', 'data-hash-name'} или None
+        """
+        soup = BeautifulSoup(content, 'html.parser')
+        items = soup.find_all('div', {"class": cls.SEARCH_CLASS})
+        if not items:
+            return None
+        # Найдем среди списка карточек нужную
+        attrs = next(
+            x.attrs for x in items if name in x.attrs['data-hash-name']
+        )
+        return {
+            'data-appid': attrs['data-appid'],
+            'data-hash-name': attrs['data-hash-name']
+        }
+
+    @classmethod
+    def extract_item_nameid(cls, content: bytes):
+        """Идентификатор предмета из вызова Market_LoadOrderSpread"""
+        soup = BeautifulSoup(content, 'html.parser')
+        script = next(
+            x.contents[0] for x in soup.find_all('script') if
+            x.contents and cls.ORDER_SPREAD in x.contents[0]
+        )
+        wanted_row = next(
+            x for x in script.string.split('\r\n\t\t')
+            if cls.ORDER_SPREAD in x
+        )
+        return wanted_row.lstrip(cls.ORDER_SPREAD + '(').split(')')[0].strip()
@@ -0,0 +1,397 @@
+import logging
+import multiprocessing
+import queue
+import threading
+
+import settings
+from cargo.utils import Commonly
+from logic.control import Control
+from logic.market import UnknownItemError
+from logic.parsers import MarketPages
+from logic.storage import Storage
+
+info_logger = logging.getLogger("info_logger")
+error_logger = logging.getLogger("error_logger")
+
+
+def parse_worker(tasks, results):
+    """
+    Разбор страниц торговой площадки в отдельном процессе.
+    Функция уровня модуля, чтобы ее можно было запустить через spawn:
+    задачи и результаты - только строки и байты
+    :param tasks: очередь (вид страницы, имя набора, байты страницы),
+                  None - завершение
+    :param results: очередь (вид страницы, имя набора, результат, ошибка)
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        kind, name, content = task
+        try:
+            if kind == ScanPipeline.SEARCH:
+                result = MarketPages.extract_search_item(content, name)
+            else:
+                result = MarketPages.extract_item_nameid(content)
+            results.put((kind, name, result, None))
+        except Exception as error:
+            error = f'{type(error).__name__}: {error}'
+            results.put((kind, name, None, error))
+
+
+class ScanPipeline:
+    """
+    Потоковая проверка рентабельности наборов по этапам:
+    запросы (потоки) -> разбор страниц (процессы) -> расчет -> запись.
+    Этапы связаны очередями ограниченного размера: быстрый этап ждет
+    медленный, поэтому память не растет, а разбор HTML в процессах
+    не держит GIL, пока потоки ждут ответов Steam.
+    Наборы, предмет которых еще не известен, проходят через разбор
+    и возвращаются на запрос цен вторым проходом
+    """
+
+    # Виды задач этапа запросов
+    RESOLVE = 'resolve'
+    SEARCH = 'search'
+    LISTING = 'listing'
+    PRICES = 'prices'
+
+    PARSE_PROCESSES = max(settings.PARSE_PROCESSES, 0)
+    # Процессы разбора запускаются из потока запросов, пока другие
+    # потоки держат блокировки, поэтому fork небезопасен
+    PARSE_CONTEXT = multiprocessing.get_context('spawn')
+    QUEUE_SIZE = max(settings.PIPELINE_QUEUE_SIZE, 1)
+    # По сколько наборов считается рентабельность и пишутся результаты
+    EVALUATE_BATCH = 50
+    WRITE_BATCH = 100
+    # Сколько ждать хоть какого-то результата, прежде чем бросить проверку
+    # (пауза по команде управления и пауза предохранителя не считаются)
+    STALL_TIMEOUT = 600
+    # Как часто проверяется, не остановлена ли проверка (в секундах)
+    STOP_CHECK = 1
+
+    def __init__(self, user, pouch_price, concurrency: int,
+                 parse_processes: int = None):
+        """
+        :param user: SteamUser, чьей сессией идут запросы
+        :param pouch_price: цена мешка самоцветов
+        :param concurrency: количество потоков запросов
+        :param parse_processes: количество процессов разбора
+                                (0 - разбор в потоке этого процесса,
+                                по умолчанию PARSE_PROCESSES)
+        """
+        self.user = user
+        self.pouch_price = pouch_price
+        self.concurrency = max(concurrency, 1)
+        self.parse_processes = (
+            self.PARSE_PROCESSES if parse_processes is None
+            else parse_processes
+        )
+        self.bundles = {}
+        self.priced = []
+        self._reresolved = set()
+        # Атрибуты предметов, чьи страницы ждут разбора
+        self._listings = {}
+        self._fetch_queue = queue.Queue(self.QUEUE_SIZE)
+        # Второй проход берется раньше новых наборов и не ограничен:
+        # его размер и так ограничен очередями разбора, а ограничение
+        # замкнуло бы цикл запросы -> разбор -> запросы
+        self._second_pass = queue.Queue()
+        self._priced_queue = queue.Queue(self.QUEUE_SIZE)
+        self._write_queue = queue.Queue(self.QUEUE_SIZE)
+        self._parse_tasks = None
+        self._parse_results = None
+        self._parsers = []
+        self._parsers_lock = threading.Lock()
+        # Проверка брошена: этапы отбрасывают свою работу
+        self._stopped = threading.Event()
+
+    def run(self, bundles):
+        """
+        Проверка наборов
+        :return: [(набор, цена продажи, цена покупки)] - наборы с ценами
+        """
+        if not bundles:
+            return []
+        self.bundles = {bundle.name: bundle for bundle in bundles}
+        fetchers = [
+            Commonly.thread(self._fetch_stage)()
+            for _ in range(self.concurrency)
+        ]
+        evaluator = Commonly.thread(self._evaluate_stage)(len(bundles))
+        writer = Commonly.thread(self._write_stage)()
+        try:
+            # Очередь ограничена: новые наборы подаются по мере обработки
+            for bundle in bundles:
+                task = self.RESOLVE, bundle.name, None
+                if not self._put(self._fetch_queue, task):
+                    break
+            evaluator.join()
+        finally:
+            for _ in fetchers:
+                self._fetch_queue.put(None)
+            for fetcher in fetchers:
+                fetcher.join()
+            self._stop_parsers()
+            self._write_queue.put(None)
+            writer.join()
+        return self.priced
+
+    def _fetch_stage(self):
+        """Этап запросов: только сеть, без разбора HTML"""
+        while True:
+            try:
+                task = self._second_pass.get_nowait()
+            except queue.Empty:
+                try:
+                    task = self._fetch_queue.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+            if task is None:
+                break
+            if self._stopped.is_set():
+                continue
+            Control.wait_if_paused(self.user.account)
+            kind, name, item = task
+            try:
+                self._fetch(kind, name, item)
+            except Exception as error:
+                error_logger.error(
+                    f'{name}: цены не получены. {error}',
+                    extra=dict(account=self.user.account, bundle=name)
+                )
+                self._put(self._priced_queue, (name, None))
+
+    def _fetch(self, kind, name, item):
+        user = self.user
+        if kind == self.RESOLVE:
+            item = user._load_market_items().get(name)
+            if item:
+                self._second_pass.put((self.PRICES, name, item))
+                return
+            listing = user._find_market_item_in_index(name)
+            if listing:
+                self._fetch(self.LISTING, name, listing)
+                return
+            content = user._get(*user._search_request(name)).content
+            self._parse(self.SEARCH, name, content)
+        elif kind == self.LISTING:
+            content = user._get(user._listing_url(item)).content
+            # Атрибуты предмета нужны после разбора, а в процесс
+            # передаются только байты страницы
+            self._listings[name] = item
+            self._parse(self.LISTING, name, content)
+        else:
+            self._fetch_prices(name, item)
+
+    def _fetch_prices(self, name, item):
+        try:
+            prices = self.user._get_market_item_prices(name, item, 'scan')
+        except UnknownItemError:
+            if name in self._reresolved:
+                raise
+            # Сохраненный идентификатор устарел - найдем его заново
+            self._reresolved.add(name)
+            self._second_pass.put((self.RESOLVE, name, None))
+            return
+        self._put(self._priced_queue, (name, prices))
+
+    def _parse(self, kind, name, content):
+        """Передача страницы на разбор (ждет, если этап разбора занят)"""
+        self._start_parsers()
+        self._parse_tasks.put((kind, name, content))
+
+    def _start_parsers(self):
+        """Этап разбора запускается, только если есть что разбирать"""
+        with self._parsers_lock:
+            if self._parse_tasks is not None:
+                return
+            if self.parse_processes > 0:
+                context = self.PARSE_CONTEXT
+                self._parse_tasks = context.Queue(self.QUEUE_SIZE)
+                self._parse_results = context.Queue(self.QUEUE_SIZE)
+                self._parsers = [
+                    Commonly.process(parse_worker, context)(
+                        self._parse_tasks, self._parse_results
+                    )
+                    for _ in range(self.parse_processes)
+                ]
+            else:
+                self._parse_tasks = queue.Queue(self.QUEUE_SIZE)
+                self._parse_results = queue.Queue(self.QUEUE_SIZE)
+                self._parsers = [
+                    Commonly.thread(parse_worker)(
+                        self._parse_tasks, self._parse_results
+                    )
+                ]
+            self._router = Commonly.thread(self._route_stage)()
+
+    def _stop_parsers(self):
+        with self._parsers_lock:
+            if self._parse_tasks is None:
+                return
+            for _ in self._parsers:
+                self._parse_tasks.put(None)
+            for parser in self._parsers:
+                parser.join()
+            self._parse_results.put(None)
+            self._router.join()
+
+    def _route_stage(self):
+        """Результаты разбора: на страницу предмета или на запрос цен"""
+        while True:
+            result = self._parse_results.get()
+            if result is None:
+                break
+            kind, name, value, error = result
+            if self._stopped.is_set():
+                self._listings.pop(name, None)
+                continue
+            try:
+                self._route(kind, name, value, error)
+            except Exception as error:
+                # Набор все равно должен дойти до расчета,
+                # иначе проверка будет ждать его до STALL_TIMEOUT
+                error_logger.error(
+                    f'{name}: страница не разобрана. {error}',
+                    extra=dict(account=self.user.account, bundle=name)
+                )
+                self._listings.pop(name, None)
+                self._put(self._priced_queue, (name, None))
+
+    def _route(self, kind, name, value, error):
+        if error:
+            raise ValueError(error)
+        if kind == self.SEARCH:
+            if value:
+                self._second_pass.put((self.LISTING, name, value))
+            else:
+                # Набор не продается: цен нет
+                self._put(self._priced_queue, (name, (None, None)))
+            return
+        listing = self._listings.pop(name)
+        if not value:
+            raise ValueError('на странице нет идентификатора предмета')
+        item = self.user._make_market_item(listing, value)
+        # Только что найденный идентификатор заново не ищется
+        self._reresolved.add(name)
+        # В кэш сразу, а в БД - пакетом через этап записи
+        self.user._remember_market_item(name, item, persist=False)
+        self._write_queue.put((self.user.MARKET_ITEMS, name, item))
+        self._second_pass.put((self.PRICES, name, item))
+
+    def _evaluate_stage(self, total: int):
+        """Расчет рентабельности пачками по мере поступления цен"""
+        chunk = []
+        done = 0
+        idle = 0
+        check = min(self.STOP_CHECK, self.STALL_TIMEOUT)
+        while done < total:
+            try:
+                name, prices = self._priced_queue.get(timeout=check)
+            except queue.Empty:
+                if not self._is_waiting():
+                    idle += check
+                if idle < self.STALL_TIMEOUT:
+                    continue
+                error_logger.error(
+                    f'Проверка наборов остановлена: нет результатов '
+                    f'{self.STALL_TIMEOUT} с. (проверено {done}/{total})'
+                )
+                self._stop()
+                break
+            idle = 0
+            done += 1
+            info_logger.info(
+                f"Проверено: {done}/{total}",
+                extra=dict(
+                    account=self.user.account, phase='profitability',
+                    bundle=name
+                )
+            )
+            Control.update(self.user.account, scan_done=done, scan_total=total)
+            if prices is None:
+                continue
+            chunk.append((self.bundles[name], *prices))
+            self._write_queue.put(('prices', name, prices))
+            if len(chunk) >= self.EVALUATE_BATCH:
+                self._evaluate(chunk)
+                chunk = []
+        if chunk:
+            self._evaluate(chunk)
+
+    def _is_waiting(self):
+        """Проверка стоит не по своей вине: пауза или ограничение Steam"""
+        return (
+            Control.is_paused(self.user.account)
+            or self.user.CIRCUIT_BREAKER.remaining > 0
+        )
+
+    def _stop(self):
+        """
+        Остановка проверки: результаты больше никто не ждет,
+        поэтому этапы отбрасывают работу, а уже готовые результаты
+        выбрасываются, чтобы никто не ждал места в очереди
+        """
+        self._stopped.set()
+        while True:
+            try:
+                self._priced_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _put(self, tasks, task):
+        """
+        Постановка в ограниченную очередь, пока проверка не остановлена
+        :return: False, если проверка остановлена и задача отброшена
+        """
+        while not self._stopped.is_set():
+            try:
+                tasks.put(task, timeout=self.STOP_CHECK)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _evaluate(self, chunk):
+        self.priced += chunk
+        try:
+            evaluation = self.user._rate_bundles(chunk, self.pouch_price)
+        except Exception as error:
+            # Цены уже в точке восстановления, а этап должен дожить
+            # до конца, иначе остальные этапы встанут на полной очереди
+            error_logger.error(f'Рентабельность не посчитана. {error}')
+            return
+        self._write_queue.put(('evaluation', chunk, evaluation))
+
+    def _write_stage(self):
+        """Единственный писатель: записи копятся и пишутся одним пакетом"""
+        stop = False
+        while not stop:
+            records = [self._write_queue.get()]
+            while len(records) < self.WRITE_BATCH:
+                try:
+                    records.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if records[-1] is None:
+                records.pop()
+                stop = True
+            try:
+                self._write(records)
+            except Exception as error:
+                error_logger.error(f'Результаты проверки не записаны. {error}')
+
+    def _write(self, records):
+        user = self.user
+        market_items = {}
+        with Storage.batch(), user.storage.batch():
+            for kind, key, value in records:
+                if kind == 'prices':
+                    user.checkpoint.add_prices(key, value)
+                elif kind == 'evaluation':
+                    user._persist_evaluation(key, value)
+                else:
+                    market_items[key] = value
+            if market_items:
+                Storage.write(market_items, user.MARKET_ITEMS)
@@ -0,0 +1,172 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import settings
+
+info_logger = logging.getLogger("info_logger")
+
+
+class CycleProfiler:
+    """
+    Профилирование отдельных циклов бота (cProfile + tracemalloc).
+    Включается настройкой PROFILE_EVERY_N_CYCLES или переменной окружения
+    STEAM_CRAFTER_PROFILE: профилируется каждый N-й цикл, а отчет с самыми
+    затратными функциями и местами выделения памяти пишется в PROFILE_FOLDER.
+    Время считается по процессорному времени потока, поэтому сон
+    и ожидание ответов Steam в отчет не попадают.
+    Профайлер подключается ко всем новым потокам процесса, поэтому
+    при нескольких аккаунтах (Orchestrator) циклы не профилируются:
+    в отчет попали бы чужие потоки
+    """
+
+    ENV_VARIABLE = 'STEAM_CRAFTER_PROFILE'
+    FOLDER = settings.PROFILE_FOLDER
+    # Сколько строк выводится в каждой таблице отчета
+    TOP_LIMIT = 30
+    # Глубина стека для мест выделения памяти (каждый кадр заметно
+    # замедляет профилируемый цикл)
+    TRACEMALLOC_FRAMES = 1
+
+    # Сколько аккаунтов работает в процессе (задает Orchestrator)
+    _accounts = 1
+    _warned = False
+    # Одновременно профилируется только один цикл
+    _active = threading.Lock()
+
+    def __init__(self, account: str = None):
+        self.account = account
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_every_n(cls):
+        """Каждый какой цикл профилировать (0 - не профилировать)"""
+        value = os.environ.get(cls.ENV_VARIABLE)
+        if value is None:
+            return settings.PROFILE_EVERY_N_CYCLES
+        try:
+            return max(int(value), 0)
+        except ValueError:
+            return 0
+
+    @classmethod
+    def set_accounts(cls, count: int):
+        """Количество аккаунтов, работающих в процессе"""
+        cls._accounts = count
+
+    @classmethod
+    @contextmanager
+    def maybe(cls, cycle: int, account: str = None):
+        """
+        Профилирование цикла, если пришла его очередь
+        :param cycle: номер цикла, начиная с 1
+        """
+        every_n = cls.get_every_n()
+        if not every_n or cycle % every_n:
+            yield
+            return
+        if cls._accounts > 1:
+            if not cls._warned:
+                cls._warned = True
+                info_logger.info(
+                    'Профилирование отключено: в процессе работает '
+                    'несколько аккаунтов'
+                )
+            yield
+            return
+        if not cls._active.acquire(blocking=False):
+            yield
+            return
+        try:
+            with cls(account).profile(cycle):
+                yield
+        finally:
+            cls._active.release()
+
+    @contextmanager
+    def profile(self, cycle: int):
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        tracemalloc_owner = not tracemalloc.is_tracing()
+        if tracemalloc_owner:
+            tracemalloc.start(self.TRACEMALLOC_FRAMES)
+        # Потоки, созданные за время цикла (пулы проверки и продажи),
+        # профилируются каждый своим профайлером
+        threading.setprofile(self._start_thread_profile)
+        main_profile = self._enable(cProfile.Profile(time.thread_time))
+        try:
+            yield
+        finally:
+            threading.setprofile(None)
+            if main_profile:
+                main_profile.disable()
+            with self._lock:
+                profiles = list(self._profiles)
+            for profile in profiles:
+                profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if tracemalloc_owner:
+                tracemalloc.stop()
+            path = self.write_report(
+                cycle, profiles, snapshot, peak,
+                wall=time.perf_counter() - started,
+                cpu=time.process_time() - cpu_started
+            )
+            info_logger.info(f'Отчет профилирования цикла: {path}')
+
+    def write_report(self, cycle, profiles, snapshot, peak, wall, cpu):
+        """Запись отчета. Возвращает путь к файлу"""
+        os.makedirs(self.FOLDER, exist_ok=True)
+        account = f'_{self.account}' if self.account else ''
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(
+            self.FOLDER, f'profile{account}_{timestamp}_cycle{cycle}.txt'
+        )
+        stream = io.StringIO()
+        stream.write(
+            f'Цикл №{cycle}{f" ({self.account})" if self.account else ""}\n'
+            f'Время: {wall:.2f} с., процессорное время: {cpu:.2f} с. '
+            f'(разница - ожидание сети и сон)\n'
+            f'Пик памяти (tracemalloc): {peak / 2 ** 20:.1f} MB\n'
+        )
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=stream)
+            for sort_key in ('tottime', 'cumulative'):
+                stream.write(f'\n=== Функции по {sort_key} ===\n')
+                stats.sort_stats(sort_key).print_stats(self.TOP_LIMIT)
+        stream.write('\n=== Места выделения памяти ===\n')
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        for stat in snapshot.statistics('lineno')[:self.TOP_LIMIT]:
+            stream.write(f'{stat}\n')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(stream.getvalue())
+        return path
+
+    def _start_thread_profile(self, frame, event, arg):
+        """Вызывается в каждом новом потоке перед его запуском"""
+        sys.setprofile(None)
+        self._enable(cProfile.Profile(time.thread_time))
+
+    def _enable(self, profile):
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: профайлер один на весь процесс
+            # и уже видит все потоки
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
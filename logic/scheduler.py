@@ -0,0 +1,156 @@
+import heapq
+import statistics
+import threading
+import time
+
+from dateutil.parser import parse
+
+
+class RecheckScheduler:
+    """
+    Расписание повторных проверок наборов на рентабельность.
+    Наборы лежат в куче по времени следующей проверки, а интервал
+    до нее подбирается для каждого набора отдельно: чем ближе маржа
+    к минимальной, чем сильнее скачет цена и чем чаще набор оказывался
+    рентабельным, тем раньше его стоит проверить снова
+    """
+
+    # Сектор хранилища с расписанием
+    SCHEDULE = 'SCHEDULE'
+    # Сколько последних значений маржи учитывается
+    HISTORY_SIZE = 10
+
+    def __init__(self, entries: dict, min_margin: int,
+                 min_interval: float, max_interval: float):
+        """
+        :param entries: сохраненное расписание {имя набора: данные}
+        :param min_margin: минимальная маржа рентабельного набора
+        :param min_interval: минимальный интервал между проверками (сек.)
+        :param max_interval: максимальный интервал между проверками (сек.)
+        """
+        self.entries = entries
+        self.min_margin = min_margin
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+
+    @classmethod
+    def seed_entries(cls, bad_bundles: dict, actual_hours: int):
+        """
+        Расписание для наборов, которые проверялись до появления
+        планировщика: следующая проверка - как раньше, через actual_hours
+        """
+        entries = {}
+        for name, info in bad_bundles.items():
+            if not info.get('updated'):
+                continue
+            updated = parse(info['updated']).timestamp()
+            margins = [info['margin']] if info['margin'] > -1000 else []
+            entries[name] = dict(
+                next_check=updated + actual_hours * 3600,
+                margins=margins,
+                checks=1,
+                wins=0
+            )
+        return entries
+
+    def due(self, names, limit: int = None, now: float = None):
+        """
+        Наборы, проверку которых пора провести, от самых просроченных.
+        Новые наборы (без расписания) проверяются в первую очередь
+        :param names: наборы, доступные для крафта
+        :param limit: сколько наборов можно проверить за цикл (0 - все)
+        """
+        now = now or time.time()
+        heap = [
+            (self.entries[name]['next_check'] if name in self.entries else 0,
+             name)
+            for name in names
+        ]
+        heapq.heapify(heap)
+        due_names = []
+        while heap and heap[0][0] <= now:
+            due_names.append(heapq.heappop(heap)[1])
+            if limit and len(due_names) >= limit:
+                break
+        return due_names
+
+    def expedite(self, names, now: float = None):
+        """
+        Проверить наборы в этом цикле (изменились с прошлого цикла)
+        :return: {имя набора: обновленные данные} для записи в хранилище
+        """
+        now = now or time.time()
+        updated = {}
+        with self._lock:
+            for name in names:
+                entry = self.entries.get(name)
+                if entry and entry['next_check'] > now:
+                    entry['next_check'] = now
+                    updated[name] = dict(entry)
+        return updated
+
+    def postpone(self, name: str, until: float):
+        """
+        Не проверять набор раньше until (например, пока его нельзя создать)
+        :return: обновленные данные или None, если расписание не менялось
+        """
+        with self._lock:
+            entry = self.entries.get(name)
+            if not entry or entry['next_check'] >= until:
+                return None
+            entry['next_check'] = until
+            return dict(entry)
+
+    def forget(self, names):
+        """Удаление наборов, которых больше нет на странице"""
+        with self._lock:
+            return [
+                name for name in names
+                if self.entries.pop(name, None) is not None
+            ]
+
+    def record(self, name: str, margin, now: float = None,
+               estimated: bool = False):
+        """
+        Учет результата проверки набора
+        :param margin: маржа набора или None, если набор нельзя продать
+        :param estimated: маржа - лишь оценка по сводке цен: она сдвигает
+                          следующую проверку, но в историю не попадает
+        :return: обновленные данные расписания набора
+        """
+        now = now or time.time()
+        with self._lock:
+            entry = self.entries.setdefault(
+                name, dict(next_check=now, margins=[], checks=0, wins=0)
+            )
+            if estimated:
+                entry['next_check'] = now + self.get_interval(entry, margin)
+                return dict(entry)
+            entry['checks'] += 1
+            if margin is not None:
+                entry['margins'] = (
+                    entry['margins'] + [margin]
+                )[-self.HISTORY_SIZE:]
+                if margin > self.min_margin:
+                    entry['wins'] += 1
+            entry['next_check'] = now + self.get_interval(entry, margin)
+            return dict(entry)
+
+    def get_interval(self, entry: dict, margin):
+        """Интервал до следующей проверки набора (в секундах)"""
+        # Набор нельзя продать: вряд ли это скоро изменится
+        if margin is None:
+            return self.max_interval
+        # Рентабельный набор нужно перепроверять каждый цикл
+        gap = self.min_margin - margin
+        if gap < 0:
+            return self.min_interval
+        margins = entry['margins']
+        volatility = statistics.pstdev(margins) if len(margins) > 1 else 0
+        # Сколько "типичных колебаний" цены отделяет набор от рентабельности
+        distance = gap / (volatility + self.min_margin)
+        interval = self.min_interval * (1 + distance) ** 2
+        # Часто рентабельные наборы проверяем до двух раз чаще
+        interval *= 1 - entry['wins'] / max(entry['checks'], 1) / 2
+        return min(max(interval, self.min_interval), self.max_interval)
@@ -1,5 +1,184 @@
+import atexit
+import dbm
+import json
 import os
 import shelve
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+
+
+class ShelveBackend:
+    """Хранилище в файле shelve: каждый сектор хранится целиком"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self):
+        with shelve.open(self.path) as db:
+            return dict(db.items())
+
+    def get_sector(self, primary_key: str):
+        with shelve.open(self.path) as db:
+            return db.get(primary_key, {})
+
+    def write(self, data: dict, primary_key: str):
+        with shelve.open(self.path) as db:
+            sector = db.setdefault(primary_key, {})
+            sector.update(data)
+            db[primary_key] = sector
+
+    def remove(self, key: str, primary_key: str):
+        with shelve.open(self.path) as db:
+            sector = db.get(primary_key, {})
+            sector.pop(key, None)
+            db[primary_key] = sector
+
+    def clear(self, primary_key: str):
+        with shelve.open(self.path) as db:
+            db[primary_key] = {}
+
+    def clear_all(self):
+        with shelve.open(self.path) as db:
+            db.clear()
+
+    # shelve все равно перезаписывает сектор целиком, пакеты не нужны
+    def begin(self):
+        pass
+
+    def end(self, failed=False):
+        pass
+
+
+class SqliteBackend:
+    """
+    Хранилище в SQLite (WAL): каждая запись сектора - отдельная строка,
+    поэтому стоимость записи не зависит от размера сектора
+    """
+
+    EXTENSION = '.sqlite3'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._batch_depth = 0
+        self.connection = sqlite3.connect(
+            path + self.EXTENSION,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'sector TEXT NOT NULL, '
+            'key TEXT NOT NULL, '
+            'value TEXT NOT NULL, '
+            'PRIMARY KEY (sector, key)'
+            ') WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+        self._migrate_from_shelve()
+
+    def load(self):
+        data = {}
+        rows = self.connection.execute(
+            'SELECT sector, key, value FROM records'
+        )
+        for sector, key, value in rows:
+            data.setdefault(sector, {})[key] = json.loads(value)
+        return data
+
+    def get_sector(self, primary_key: str):
+        rows = self.connection.execute(
+            'SELECT key, value FROM records WHERE sector = ?', (primary_key,)
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    def write(self, data: dict, primary_key: str):
+        with self.batch():
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO records (sector, key, value) '
+                'VALUES (?, ?, ?)',
+                [
+                    (primary_key, str(key), json.dumps(value))
+                    for key, value in data.items()
+                ]
+            )
+
+    def remove(self, key: str, primary_key: str):
+        with self.batch():
+            self.connection.execute(
+                'DELETE FROM records WHERE sector = ? AND key = ?',
+                (primary_key, key)
+            )
+
+    def clear(self, primary_key: str):
+        with self.batch():
+            self.connection.execute(
+                'DELETE FROM records WHERE sector = ?', (primary_key,)
+            )
+
+    def clear_all(self):
+        with self.batch():
+            self.connection.execute('DELETE FROM records')
+
+    def begin(self):
+        """
+        Начало пакета: внешний пакет открывает транзакцию,
+        а вложенный - точку сохранения внутри нее
+        """
+        if self._batch_depth:
+            self.connection.execute(f'SAVEPOINT batch{self._batch_depth}')
+        else:
+            self.connection.execute('BEGIN')
+        self._batch_depth += 1
+
+    def end(self, failed=False):
+        """
+        Завершение пакета. Пакет, прерванный исключением, откатывает
+        только свои записи: вложенный - до своей точки сохранения
+        :param failed: пакет прерван исключением
+        """
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self.connection.execute('ROLLBACK' if failed else 'COMMIT')
+            return
+        savepoint = f'batch{self._batch_depth}'
+        if failed:
+            self.connection.execute(f'ROLLBACK TO {savepoint}')
+        self.connection.execute(f'RELEASE {savepoint}')
+
+    @contextmanager
+    def batch(self):
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.end(failed=True)
+            raise
+        self.end()
+
+    def _migrate_from_shelve(self):
+        """Однократный перенос данных из старого хранилища shelve"""
+        is_migrated = self.connection.execute(
+            "SELECT 1 FROM meta WHERE key = 'shelve_migrated'"
+        ).fetchone()
+        if is_migrated:
+            return
+        with self.batch():
+            if dbm.whichdb(self.path):
+                shelve_data = ShelveBackend(self.path).load()
+                for primary_key, sector in shelve_data.items():
+                    self.write(sector, primary_key)
+            self.connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('shelve_migrated', '1')"
+            )
 
 
 class Storage:
@@ -8,33 +187,191 @@ class Storage:
     BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     FOLDER_PATH = os.path.join(BASE_PATH, 'db')
     STORAGE_PATH = os.path.join(FOLDER_PATH, 'storage')
+    BACKENDS = dict(shelve=ShelveBackend, sqlite=SqliteBackend)
+    BACKEND = settings.STORAGE_BACKEND
+    # Хранилище общее для всех потоков, в которых проверяются наборы
+    _lock = threading.RLock()
+    _backends = {}
+
+    # Папка с хранилищами отдельных аккаунтов
+    ACCOUNTS_FOLDER = 'accounts'
+    _accounts = {}
 
     @classmethod
     def create_folder_path(cls):
         if not os.path.exists(cls.FOLDER_PATH):
             os.mkdir(cls.FOLDER_PATH)
+        os.makedirs(os.path.dirname(cls.STORAGE_PATH), exist_ok=True)
+
+    @classmethod
+    def for_account(cls, account: str = None):
+        """
+        Хранилище отдельного аккаунта
+        :param account: имя аккаунта (None - общее хранилище)
+        """
+        if not account:
+            return cls
+        with cls._lock:
+            key = cls, account
+            if key not in cls._accounts:
+                path = os.path.join(
+                    cls.FOLDER_PATH, cls.ACCOUNTS_FOLDER, account,
+                    os.path.basename(cls.STORAGE_PATH)
+                )
+                cls._accounts[key] = type(
+                    cls.__name__, (cls,), dict(STORAGE_PATH=path)
+                )
+            return cls._accounts[key]
 
     @classmethod
     def open(cls):
-        with shelve.open(cls.STORAGE_PATH) as db:
-            return dict(db.items())
+        with cls._lock:
+            return cls._backend().load()
+
+    @classmethod
+    def get_sector(cls, primary_key: str):
+        with cls._lock:
+            return cls._backend().get_sector(primary_key)
 
     @classmethod
     def write(cls, data: dict, primary_key: str):
-        with shelve.open(cls.STORAGE_PATH) as db:
-            sector = db.setdefault(primary_key, {})
-            sector.update(data)
-            db[primary_key] = sector
+        with cls._lock:
+            cls._backend().write(data, primary_key)
+
+    @classmethod
+    def remove(cls, key: str, primary_key: str):
+        with cls._lock:
+            cls._backend().remove(key, primary_key)
 
     @classmethod
     def clear(cls, primary_key: str):
-        with shelve.open(cls.STORAGE_PATH) as db:
-            db[primary_key] = {}
+        with cls._lock:
+            cls._backend().clear(primary_key)
 
     @classmethod
     def clear_all(cls):
-        with shelve.open(cls.STORAGE_PATH) as db:
-            db.clear()
+        with cls._lock:
+            cls._backend().clear_all()
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """Объединение множества записей в одну транзакцию"""
+        # Соединение с БД одно на все потоки, поэтому блокировка
+        # держится весь пакет: иначе записи других потоков попали бы
+        # в его транзакцию и откатились бы вместе с ним
+        with cls._lock:
+            backend = cls._backend()
+            backend.begin()
+            try:
+                yield
+            except BaseException:
+                # Наполовину записанный пакет не сохраняется
+                backend.end(failed=True)
+                raise
+            backend.end()
+
+    @classmethod
+    def _backend(cls):
+        """Бэкенд хранилища, открытый один раз на процесс"""
+        with cls._lock:
+            key = cls.BACKEND, cls.STORAGE_PATH
+            if key not in cls._backends:
+                if not os.path.isdir(os.path.dirname(cls.STORAGE_PATH)):
+                    raise FileNotFoundError(cls.STORAGE_PATH)
+                backend = cls.BACKENDS[cls.BACKEND]
+                cls._backends[key] = backend(cls.STORAGE_PATH)
+            return cls._backends[key]
+
+
+class Counters:
+    """
+    Счетчики статистики в памяти.
+    Каждое приращение дописывается в журнал (файл рядом с хранилищем),
+    а в само хранилище попадает пачкой раз в FLUSH_INTERVAL секунд
+    или при завершении работы. После записи в хранилище журнал очищается.
+    Номер последнего примененного приращения хранится вместе со счетчиками,
+    поэтому после падения журнал не будет учтен дважды
+    """
+
+    LOG_EXTENSION = '.log'
+    # Сектор хранилища с номером последнего примененного приращения
+    APPLIED_KEY = 'applied_seq'
+
+    def __init__(self, storage, flush_interval: int):
+        """
+        :param storage: класс хранилища статистики
+        :param flush_interval: как часто сбрасывать счетчики (в секундах)
+        """
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.log_path = storage.STORAGE_PATH + self.LOG_EXTENSION
+        self.lock = threading.Lock()
+        # Незаписанные в хранилище приращения
+        self.pending = {}
+        # Текущие значения счетчиков: статистика читается из памяти
+        self.totals = {
+            key: sector.get('value', 0)
+            for key, sector in storage.open().items()
+            if key != self.APPLIED_KEY
+        }
+        applied_seq = storage.get_sector(self.APPLIED_KEY).get('value', 0)
+        self.seq = applied_seq
+        # Остатки журнала после падения
+        for seq, key, amount in self.read_log(self.log_path, applied_seq):
+            self.pending[key] = self.pending.get(key, 0) + amount
+            self.totals[key] = self.totals.get(key, 0) + amount
+            self.seq = seq
+        self.log = open(self.log_path, 'a', encoding='utf-8')
+        self.flushed_at = time.monotonic()
+        atexit.register(self.flush)
+
+    def inc(self, key: str, amount: int):
+        with self.lock:
+            self.seq += 1
+            self.log.write(f'{self.seq} {key} {amount}\n')
+            self.log.flush()
+            self.pending[key] = self.pending.get(key, 0) + amount
+            self.totals[key] = self.totals.get(key, 0) + amount
+            is_due = time.monotonic() - self.flushed_at >= self.flush_interval
+        if is_due:
+            self.flush()
+
+    def flush(self):
+        """Запись накопленных приращений в хранилище и сжатие журнала"""
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.pending:
+                return
+            with self.storage.batch():
+                for key, amount in self.pending.items():
+                    sector = self.storage.get_sector(key)
+                    value = sector.get('value', 0) + amount
+                    self.storage.write(dict(value=value), key)
+                self.storage.write(dict(value=self.seq), self.APPLIED_KEY)
+            self.pending.clear()
+            self.log.close()
+            self.log = open(self.log_path, 'w', encoding='utf-8')
+
+    @staticmethod
+    def read_log(log_path: str, applied_seq: int):
+        """Приращения из журнала, которые еще не попали в хранилище"""
+        try:
+            with open(log_path, encoding='utf-8') as log:
+                lines = log.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                seq, key, amount = line.split()
+                seq, amount = int(seq), int(amount)
+            except ValueError:
+                # Недописанная при падении строка
+                continue
+            if seq > applied_seq:
+                entries.append((seq, key, amount))
+        return entries
 
 
 class StatsStorage(Storage):
@@ -48,30 +385,48 @@ class StatsStorage(Storage):
         sold_bundles='Наборов продано',
         gems_spend='Самоцветов потрачено',
     )
+    # Как часто счетчики сбрасываются из памяти в хранилище (в секундах)
+    FLUSH_INTERVAL = settings.STATS_FLUSH_SECONDS
+    _counters = {}
 
     @classmethod
     def inc_money_earned(cls, amount):
-        cls._inc_and_write('earned', amount)
+        cls._inc('earned', amount)
 
     @classmethod
     def inc_crafted_bundles(cls):
-        cls._inc_and_write('crafted')
+        cls._inc('crafted')
 
     @classmethod
-    def inc_sold_bundles(cls):
-        cls._inc_and_write('sold_bundles')
+    def inc_sold_bundles(cls, amount=1):
+        cls._inc('sold_bundles', amount)
 
     @classmethod
     def inc_gems_spent(cls, amount):
-        cls._inc_and_write('gems_spend', amount)
+        cls._inc('gems_spend', amount)
+
+    @classmethod
+    def get_totals(cls):
+        """Значения счетчиков с учетом еще не сброшенных приращений"""
+        counters = cls._counters.get(cls.STORAGE_PATH)
+        if counters:
+            # Счетчики этого процесса: без чтения хранилища
+            with counters.lock:
+                return {k: counters.totals.get(k, 0) for k in cls.KEYS_MAP}
+        storage = cls.open()
+        totals = {k: storage.get(k, {}).get('value', 0) for k in cls.KEYS_MAP}
+        applied_seq = storage.get(Counters.APPLIED_KEY, {}).get('value', 0)
+        log_path = cls.STORAGE_PATH + Counters.LOG_EXTENSION
+        for _, key, amount in Counters.read_log(log_path, applied_seq):
+            totals[key] = totals.get(key, 0) + amount
+        return totals
 
     @classmethod
     def show_stats(cls, logger=None):
         logger = logger or print
-        storage = StatsStorage.open()
+        totals = cls.get_totals()
         map_data = [
-            (v, storage.get(k, {}).get("value", 0))
-            for k, v in StatsStorage.KEYS_MAP.items()
+            (v, totals.get(k, 0)) for k, v in cls.KEYS_MAP.items()
         ]
         for name, value in map_data:
             if name == cls.KEYS_MAP['earned']:
@@ -79,7 +434,26 @@ class StatsStorage(Storage):
             logger(f'{name}: {value}')
 
     @classmethod
-    def _inc_and_write(cls, primary_key: str, amount: int = None):
-        sell_count = cls.open().get(primary_key, {}).get('value', 0)
-        cls.write(dict(value=sell_count + (amount or 1)), primary_key)
+    def flush(cls):
+        """Принудительная запись счетчиков в хранилище"""
+        counters = cls._counters.get(cls.STORAGE_PATH)
+        if counters:
+            counters.flush()
 
+    @classmethod
+    def attach(cls):
+        """
+        Счетчики в памяти этого процесса (бот): дальше статистика
+        читается из них. Процессы, которые только читают статистику,
+        их не создают
+        """
+        with cls._lock:
+            counters = cls._counters.get(cls.STORAGE_PATH)
+            if not counters:
+                counters = Counters(cls, cls.FLUSH_INTERVAL)
+                cls._counters[cls.STORAGE_PATH] = counters
+            return counters
+
+    @classmethod
+    def _inc(cls, primary_key: str, amount: int = None):
+        cls.attach().inc(primary_key, amount or 1)
@@ -0,0 +1,265 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+
+from logic.metrics import Metrics
+
+error_logger = logging.getLogger("error_logger")
+
+
+class SteamUnavailableError(requests.HTTPError):
+    """
+    Steam отвечал 429 или 5xx на все попытки запроса:
+    запрос стоит повторить позже (ответ - в атрибуте response)
+    """
+
+
+class RetryPolicy:
+    """
+    Повторы запросов с экспоненциальной паузой и случайным разбросом.
+    Пауза растет с числом неудач подряд по каждому адресу отдельно,
+    поэтому сбоящий адрес не тормозит остальные
+    """
+
+    # Коды ответов, после которых запрос стоит повторить
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, attempts: int = 4, base_delay: float = 2,
+                 max_delay: float = 120):
+        """
+        :param attempts: сколько всего попыток на запрос
+        :param base_delay: пауза после первой неудачи (в секундах)
+        :param max_delay: максимальная пауза (в секундах)
+        """
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def failure(self, endpoint: str, retry_after: float = None):
+        """
+        Учет неудачи
+        :return: пауза перед повтором (в секундах)
+        """
+        with self._lock:
+            failures = self._failures.get(endpoint, 0) + 1
+            self._failures[endpoint] = failures
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self.backoff(failures, self.base_delay, self.max_delay)
+
+    def success(self, endpoint: str):
+        with self._lock:
+            self._failures.pop(endpoint, None)
+
+    @staticmethod
+    def backoff(failures: int, base_delay: float, max_delay: float):
+        """Экспоненциальная пауза с разбросом (full jitter)"""
+        delay = min(max_delay, base_delay * 2 ** (failures - 1))
+        return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    Общий для всех потоков и аккаунтов предохранитель.
+    Когда Steam отвечает 429, все запросы приостанавливаются
+    (на Retry-After или на растущую паузу), вместо того чтобы каждый
+    поток продолжал долбить Steam и продлевать ограничение
+    """
+
+    def __init__(self, pause: float = 60, max_pause: float = 1800):
+        """
+        :param pause: пауза при первом ограничении, если Steam не указал
+                      Retry-After (в секундах)
+        :param max_pause: максимальная пауза (в секундах)
+        """
+        self.pause = pause
+        self.max_pause = max_pause
+        self._trips = 0
+        self._open_until = 0.
+        self._lock = threading.Lock()
+
+    def trip(self, retry_after: float = None):
+        """
+        Steam ограничил запросы
+        :return: на сколько секунд приостановлены запросы
+        """
+        with self._lock:
+            self._trips += 1
+            if retry_after is None:
+                pause = RetryPolicy.backoff(
+                    self._trips, self.pause, self.max_pause
+                )
+            else:
+                pause = min(retry_after, self.max_pause)
+            self._open_until = max(
+                self._open_until, time.monotonic() + pause
+            )
+        Metrics.inc('throttled_total')
+        Metrics.set('circuit_open', 1)
+        return pause
+
+    def success(self):
+        with self._lock:
+            if not self._trips:
+                return
+            self._trips = 0
+        Metrics.set('circuit_open', 0)
+
+    @property
+    def remaining(self):
+        """Сколько секунд еще действует пауза"""
+        return max(self._open_until - time.monotonic(), 0)
+
+    def wait(self, sleep=time.sleep):
+        """
+        Блокирует поток, пока действует пауза
+        :param sleep: функция сна (секунды)
+        """
+        while True:
+            remaining = self.remaining
+            if not remaining:
+                return
+            sleep(remaining)
+
+
+class SteamSession:
+    """
+    Транспорт для запросов к Steam.
+    Держит открытыми соединения (keep-alive), заранее выставленные
+    куки и заголовки, а также общие для всех запросов хуки.
+    Обрывы соединения и ответы 5xx повторяются по RetryPolicy,
+    а на 429 срабатывает общий CircuitBreaker
+    """
+
+    def __init__(self, cookies: dict, headers: dict, rate_limiter=None,
+                 pool_size: int = 10, retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None, sleep=time.sleep):
+        """
+        :param cookies: куки пользователя
+        :param headers: заголовки, которые уходят с каждым запросом
+        :param rate_limiter: общий ограничитель частоты запросов
+        :param pool_size: количество одновременно открытых соединений
+        :param retry_policy: политика повторов (по умолчанию без повторов)
+        :param circuit_breaker: общий предохранитель от ограничений Steam
+        :param sleep: функция сна (секунды) для пауз перед повторами
+        """
+        self.rate_limiter = rate_limiter
+        self.sleep = sleep
+        self.retry_policy = retry_policy or RetryPolicy(attempts=1)
+        self.circuit_breaker = circuit_breaker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(headers)
+        self.session.cookies.update(cookies)
+
+    def add_hook(self, hook):
+        """
+        Добавление хука, который вызывается на каждый полученный ответ
+        :param hook: callable(response, *args, **kwargs)
+        """
+        self.session.hooks['response'].append(hook)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Базовый метод для всех запросов.
+        Если попытки кончились, пробрасывается ошибка соединения
+        или SteamUnavailableError с последним ответом 429/5xx
+        """
+        endpoint = Metrics.get_endpoint(url)
+        attempts = self.retry_policy.attempts
+        for attempt in range(1, attempts + 1):
+            if self.circuit_breaker:
+                self.circuit_breaker.wait(self.sleep)
+            # Держимся подальше от микробана
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            # Steam время от времени рвет долгоживущие соединения
+            except (ProtocolError, requests.ConnectionError,
+                    requests.Timeout) as error:
+                error_logger.error(
+                    f'{error}. Data: '
+                    f'{kwargs.get("params") or kwargs.get("data")}'
+                )
+                if attempt == attempts:
+                    raise
+                self._retry(endpoint, 'connection')
+                continue
+
+            status_code = response.status_code
+            if status_code == 429:
+                retry_after = self.get_retry_after(response)
+                if self.circuit_breaker:
+                    # Пауза для всех потоков: ее выждет circuit_breaker.wait
+                    pause = self.circuit_breaker.trip(retry_after)
+                    error_logger.error(
+                        f'Steam ограничил запросы ({endpoint}). '
+                        f'Пауза {pause:.0f} сек.',
+                        extra=dict(
+                            endpoint=endpoint, status=status_code,
+                            latency=response.elapsed.total_seconds()
+                        )
+                    )
+                    if attempt < attempts:
+                        Metrics.inc(
+                            'retries_total', endpoint=endpoint, reason='429'
+                        )
+                elif attempt < attempts:
+                    self._retry(endpoint, '429', retry_after)
+                continue
+            if status_code in self.retry_policy.RETRY_STATUSES:
+                if attempt < attempts:
+                    self._retry(
+                        endpoint, str(status_code),
+                        self.get_retry_after(response)
+                    )
+                continue
+            self.retry_policy.success(endpoint)
+            if self.circuit_breaker:
+                self.circuit_breaker.success()
+            return response
+        raise SteamUnavailableError(
+            f'Steam не ответил ({endpoint}): {response.status_code}',
+            response=response
+        )
+
+    def close(self):
+        self.session.close()
+
+    def _retry(self, endpoint: str, reason: str, retry_after: float = None):
+        """Пауза перед повтором запроса"""
+        Metrics.inc('retries_total', endpoint=endpoint, reason=reason)
+        self.sleep(self.retry_policy.failure(endpoint, retry_after))
+
+    @staticmethod
+    def get_retry_after(response):
+        """Пауза из заголовка Retry-After (в секундах) или None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(moment.timestamp() - time.time(), 0)
@@ -1,115 +1,271 @@
 import logging
-import random
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from time import sleep
+import time
 
-import requests
 from bs4 import BeautifulSoup
-from dateutil.parser import parse
-from dateutil.relativedelta import relativedelta as t_delta
-from urllib3.exceptions import ProtocolError
 
 import settings
-from cargo.utils import RequestsUtils, Commonly
+from cargo.utils import RequestsUtils, Commonly, RateLimiter
+from logic.bundles import BundleDiff
+from logic.checkpoint import CycleCheckpoint
+from logic.control import Control
+from logic.evaluation import ProfitabilityEngine
+from logic.history import PriceHistory
+from logic.logs import Logs
+from logic.market import BoosterPacksIndex, QuoteCache, UnknownItemError
+from logic.metrics import Metrics
+from logic.parsers import BoosterCreatorPage, MarketPages
+from logic.pipeline import ScanPipeline
+from logic.profiling import CycleProfiler
+from logic.scheduler import RecheckScheduler
 from logic.storage import Storage, StatsStorage
+from logic.transport import (
+    CircuitBreaker, RetryPolicy, SteamSession, SteamUnavailableError
+)
 
-# Настройки логгеров
+# Логгеры подключаются в Logs.setup при старте бота
 error_logger = logging.getLogger("error_logger")
 info_logger = logging.getLogger("info_logger")
 sell_logger = logging.getLogger("sell_logger")
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
-
-st = logging.StreamHandler()
-st.setFormatter(formatter)
-
-er = logging.FileHandler("errors_log.txt")
-er.setFormatter(formatter)
-
-sl = logging.FileHandler("successful_sells.txt")
-sl.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
-
-info_logger.addHandler(st)
-info_logger.setLevel(logging.INFO)
-
-sell_logger.addHandler(sl)
-sell_logger.setLevel(logging.INFO)
-
-error_logger.addHandler(er)
 # TODO
 #  + автоматическая покупка мешков с самоцветами и их распоковка
 
 
 class SteamUser:
+    BASE_URL = 'https://steamcommunity.com'
+    # Сон между циклами и паузы перед повторами запросов: команды
+    # API управления их прерывают (можно подменить в бенчмарках)
+    SLEEP = staticmethod(Control.sleep)
     # Минимально допустимая маржа с продажи набора на мешок самоцветов
     MINIMAL_MARGIN = settings.MIN_MARGIN
     GOOD_B = 'GOOD_BUNDLE'
     BAD_B = 'BAD_BUNDLE'
-    # Время актуальности данных о не рентабельных наборах (в часах).
-    # Т.е. при актуализации эти бандлы будут просто пропущены, если не истекло
-    # указанное время.
+    # Последние собранные цены наборов аккаунта (для пересчета без запросов)
+    PRICES = 'BUNDLE_PRICES'
+    # Соответствие имени набора и предмета на торговой площадке
+    MARKET_ITEMS = 'MARKET_ITEMS'
+    # Снимок наборов прошлого цикла и его хэш (см. _apply_bundles_diff)
+    BUNDLES_FINGERPRINT = 'BUNDLES_FINGERPRINT'
+    BUNDLES_DIGEST = 'BUNDLES_DIGEST'
+    # item_nameid мешка самоцветов
+    GEM_POUCH_ITEM_ID = 26463978
+    # Коды success (EResult), которыми Steam сообщает, что предмета нет:
+    # InvalidParam, FileNotFound, NoMatch
+    UNKNOWN_ITEM_RESULTS = (8, 9, 42)
+    # Максимальное время актуальности данных о не рентабельных наборах
+    # (в часах). Т.е. при актуализации эти бандлы будут просто пропущены,
+    # если не истекло указанное время. Для наборов, маржа которых близка
+    # к минимальной, время подбирается меньше (см. RecheckScheduler)
     BAD_B_ACTUAL_HOURS = 48
+    RECHECK_MIN_MINUTES = settings.RECHECK_MIN_MINUTES
+    # Сколько наборов можно проверить за один цикл (0 - без ограничений)
+    SCAN_BUDGET = settings.SCAN_BUDGET
     SLEEP_TIME_MINUTES = 45
     # Максимальная цена крафта набора, которая учитывается при поиске
     # рентабельных наборов
     MAX_GEMS_PRICE = 700
+    # Сколько наборов проверяется одновременно
+    SCAN_CONCURRENCY = max(settings.SCAN_CONCURRENCY, 1)
+    # Сколько заявок на продажу отправляется одновременно
+    SELL_CONCURRENCY = max(settings.SELL_CONCURRENCY, 1)
+    # Общий на все потоки (и всех пользователей) ограничитель запросов
+    RATE_LIMITER = RateLimiter(
+        settings.REQUESTS_PER_MINUTE, burst=SCAN_CONCURRENCY
+    )
+    # Повторы неудачных запросов и общая пауза, если Steam ограничил нас
+    RETRY_POLICY = RetryPolicy(
+        attempts=settings.RETRY_ATTEMPTS,
+        base_delay=settings.RETRY_BASE_SECONDS,
+        max_delay=settings.RETRY_MAX_SECONDS
+    )
+    CIRCUIT_BREAKER = CircuitBreaker(
+        pause=settings.THROTTLE_PAUSE_SECONDS,
+        max_pause=settings.THROTTLE_MAX_PAUSE_SECONDS
+    )
+    # Пауза после упавшего цикла растет с каждым сбоем подряд (в секундах)
+    PENALTY_BASE_SECONDS = 60
+    # Кэш предметов торговой площадки (appid, market_hash_name, item_nameid).
+    # Для наборов эти данные не меняются, поэтому хранятся в БД
+    _market_items = None
+    _market_items_lock = threading.RLock()
+    _market_items_locks = {}
+    # Котировки общие для всех аккаунтов, запущенных в процессе
+    QUOTES = QuoteCache(
+        ttl=settings.QUOTE_TTL_MINUTES * 60,
+        max_size=settings.QUOTE_CACHE_SIZE
+    )
+    # Допустимый возраст котировки по месту вызова (в секундах):
+    # при проверке всех наборов, перед крафтом и перед продажей
+    QUOTE_MAX_AGE = {
+        'scan': settings.QUOTE_TTL_MINUTES * 60,
+        'craft': settings.QUOTE_TTL_CRAFT_MINUTES * 60,
+        'sell': settings.QUOTE_TTL_SELL_MINUTES * 60,
+    }
+    # Предварительный отбор наборов по сводке всех наборов с торговой
+    # площадки, которая собирается несколькими большими запросами
+    BULK_PRICING = settings.BULK_PRICING
+    BULK_PAGE_SIZE = 100
+    BOOSTER_PACKS_KEY = 'booster_packs'
+    # Идентификаторы инвентаря (steam_id, app_id) не меняются,
+    # поэтому хранятся в БД аккаунта
+    INVENTORY = 'INVENTORY'
+    # Сколько предметов инвентаря запрашивается за раз
+    INVENTORY_PAGE_SIZE = 500
+    # Записывать каждую полученную цену в историю (см. PriceHistory)
+    PRICE_HISTORY = settings.PRICE_HISTORY
+    # Сколько минут прерванный цикл можно продолжить, а не начать заново
+    CHECKPOINT_MAX_AGE_MINUTES = settings.CHECKPOINT_MAX_AGE_MINUTES
 
-    def __init__(self, cookies: str):
+    def __init__(self, cookies: str, account: str = None):
+        """
+        :param cookies: строка куков из браузера
+        :param account: имя аккаунта, если их запущено несколько
+        """
+        self.account = account
+        # У каждого аккаунта свои наборы, расписание и статистика
+        self.storage = Storage.for_account(account)
+        self.stats_storage = StatsStorage.for_account(account)
         # Подсунем сгенерированный хедер
         self.headers = RequestsUtils.get_random_header()
         # Конвертируем строку куков в словарь
         self.cookies = RequestsUtils.get_cookies_dict(cookies)
-        # Загрузим страницу с карточками и сделаем инстанс BeautifulSoup
-        self.bundle_page_soup = self.load_bundles_page()
-        # Получим данные о доступных наборах для крафта и имя пользователя
+        # Все запросы идут через одну сессию с пулом соединений
+        self.session = SteamSession(
+            cookies=self.cookies,
+            headers=self.headers,
+            rate_limiter=self.RATE_LIMITER,
+            pool_size=self.SCAN_CONCURRENCY,
+            retry_policy=self.RETRY_POLICY,
+            circuit_breaker=self.CIRCUIT_BREAKER,
+            sleep=self._pause
+        )
+        self.session.add_hook(Metrics.response_hook)
+        # Расписание проверок рентабельности наборов
+        self.scheduler = self._load_scheduler()
+        # Состояние цикла, чтобы после ошибки продолжить с того же места
+        self.checkpoint = CycleCheckpoint(
+            self.storage, self.CHECKPOINT_MAX_AGE_MINUTES * 60
+        )
+        self.checkpoint.begin()
+        # Загрузим страницу с карточками и разберем ее
+        # (или возьмем уже разобранную в прерванном цикле)
+        page_state = self.checkpoint.get_page()
+        if page_state:
+            info_logger.info('Страница наборов восстановлена после сбоя')
+            self.bundle_page = BoosterCreatorPage.from_state(page_state)
+        else:
+            self._set_bundle_page(self.load_bundles_page())
+        # Получим данные о доступных наборах для крафта, имя пользователя
+        # и количество самоцветов с уже загруженной страницы
         self._update_available_bundles(init=True)
-        self._update_gems_amount()
+        self._update_gems_amount(reload=False)
 
     @classmethod
-    def make_money(cls, cookie_string):
+    def make_money(cls, cookie_string, account=None):
         """Стартует процесс создания и продажи карточек"""
+        Logs.setup()
+        storage = Storage.for_account(account)
         # Создадим папку под БД, если ее нет
         Storage.create_folder_path()
+        storage.create_folder_path()
+        # Статистика дальше ведется в памяти (ее отдает API управления)
+        StatsStorage.for_account(account).attach()
         # Отобразим настрйоки и статистику
-        cls._show_setting()
-        cls._pretty_info(
-            'Очистка хранилища с рентабельными играми. '
-            'Ведь какие-то таковыми могут уже и не быть'
+        cls._show_setting(account)
+        checkpoint = CycleCheckpoint(
+            storage, cls.CHECKPOINT_MAX_AGE_MINUTES * 60
         )
-        Storage.clear(cls.GOOD_B)
+        if checkpoint.resumed:
+            # Рентабельные наборы прерванного цикла еще нужны
+            cls._pretty_info(
+                f'Продолжим прерванный цикл с этапа {checkpoint.phase}'
+            )
+        else:
+            cls._pretty_info(
+                'Очистка хранилища с рентабельными играми. '
+                'Ведь какие-то таковыми могут уже и не быть'
+            )
+            storage.clear(cls.GOOD_B)
+        Control.update(account, good_bundles={
+            name: info['margin']
+            for name, info in storage.get_sector(cls.GOOD_B).items()
+        })
+        cls._load_market_items()
+        Metrics.start()
+        Control.start()
+        cycle, failures = 0, 0
         while True:
+            cycle += 1
+            Control.wait_if_paused(account)
+            Control.update(account, cycle=cycle)
             try:
                 # Стартуем всю логику софта
-                cls._engage_process(cookie_string)
+                with CycleProfiler.maybe(cycle, account):
+                    cls._engage_process(cookie_string, account)
             except Exception as error:
                 error_logger.error(Commonly.exception_detail_info(str(error)))
-                # Штрафной сон
-                sleep(60 * 5)
+                # Штрафной сон: чем больше сбоев подряд, тем дольше,
+                # но не меньше паузы, которую потребовал Steam
+                failures += 1
+                Control.update(account, phase='sleep')
+                cls.SLEEP(max(
+                    RetryPolicy.backoff(
+                        failures, cls.PENALTY_BASE_SECONDS,
+                        60 * cls.SLEEP_TIME_MINUTES
+                    ),
+                    cls.CIRCUIT_BREAKER.remaining
+                ), account)
+            else:
+                failures = 0
+                # Дальше уйдем в сон Одина
+                cls._pretty_info('Поспим...')
+                Control.update(account, phase='sleep')
+                with Metrics.timer('sleep', account=account):
+                    cls.SLEEP(60 * cls.SLEEP_TIME_MINUTES, account)
 
     @classmethod
-    def _engage_process(cls, cookie_string):
-        steam = cls(cookie_string)
-        # Сначала нужно обновить ренатбельные наборы
-        cls._pretty_info('Актуализируем рентабельность наборов...')
-        steam.get_all_bundles_profitability()
-        # Далее скрафтим доступные и рентабельные наборы
-        cls._pretty_info('Скрафтим доступные и рентабельные наборы...')
-        steam.create_card_available_bundles()
-        # Далее, продадим созданные наборы и прочие,
-        # которые можно продать по минималке
-        cls._pretty_info('Продадим наборы...')
-        steam.sell_exists_bundles()
+    def _engage_process(cls, cookie_string, account=None):
+        with Metrics.timer('init', account=account):
+            steam = cls(cookie_string, account)
+        phases = (
+            # Сначала нужно обновить ренатбельные наборы
+            ('profitability', 'Актуализируем рентабельность наборов...',
+             steam.get_all_bundles_profitability),
+            # Далее скрафтим доступные и рентабельные наборы
+            ('craft', 'Скрафтим доступные и рентабельные наборы...',
+             steam.create_card_available_bundles),
+            # Далее, продадим созданные наборы и прочие,
+            # которые можно продать по минималке
+            ('sell', 'Продадим наборы...', steam.sell_exists_bundles),
+        )
+        try:
+            for phase, msg, method in phases:
+                # Этапы, пройденные до сбоя, не повторяются
+                if steam.checkpoint.is_passed(phase):
+                    continue
+                Control.wait_if_paused(account)
+                steam.checkpoint.set_phase(phase)
+                Control.update(account, phase=phase)
+                cls._pretty_info(msg)
+                with Metrics.timer(phase, account=account):
+                    method()
+        finally:
+            steam.session.close()
+        steam.checkpoint.finish()
+        steam.stats_storage.flush()
         cls._pretty_info('Очистка хранилища с рентабельными играми.')
-        Storage.clear(cls.GOOD_B)
-        # Дальше уйдем в сон Одина
-        cls._pretty_info('Поспим...')
-        sleep(60 * cls.SLEEP_TIME_MINUTES)
+        steam.storage.clear(cls.GOOD_B)
+        Control.update(account, good_bundles={})
 
     @classmethod
-    def _show_setting(cls):
-        info_logger.info('Блок статистики за все время ' + '+' * 30)
-        StatsStorage.show_stats(info_logger.info)
+    def _show_setting(cls, account=None):
+        title = f' ({account})' if account else ''
+        info_logger.info(f'Блок статистики за все время{title} ' + '+' * 30)
+        StatsStorage.for_account(account).show_stats(info_logger.info)
         cls._pretty_info('+' * 40)
         info_logger.info('Блок настроек ' + '+' * 30)
         info_logger.info(
@@ -119,8 +275,11 @@ class SteamUser:
         cls._pretty_info('+' * 40)
 
     def create_card_bundle(self, appid, series=1, tradability_preference=2):
-        """Создание набора карточек"""
-        url = 'https://steamcommunity.com/tradingcards/ajaxcreatebooster'
+        """
+        Создание набора карточек
+        :return: ответ Steam, если крафт удался, иначе None
+        """
+        url = f'{self.BASE_URL}/tradingcards/ajaxcreatebooster'
         data = dict(
             sessionid=self.cookies['sessionid'],
             appid=appid,
@@ -129,231 +288,520 @@ class SteamUser:
         )
         response = self._post(url=url, data=data)
         status_code = response.status_code
-        purchase_result = response.json()['purchase_result']
-        if status_code == 200 and purchase_result['success'] == 1:
-            return True
-        return False
+        result = response.json()
+        if status_code == 200 and result['purchase_result']['success'] == 1:
+            return result
+        return None
 
     def get_dust_amount(self):
         """Получение количества самоцветов в интвентаре"""
-        query = 'span', {'class': 'goovalue'}
-        dust = self.bundle_page_soup.find(*query).contents[0].replace(',', '')
-        return int(dust)
+        return self.bundle_page.gems_amount
 
     def load_bundles_page(self):
         """Загрузка страницы с наборами карточек"""
-        url = 'https://steamcommunity.com//tradingcards/boostercreator/'
-        return BeautifulSoup(self._get(url).content, 'html.parser')
+        url = f'{self.BASE_URL}//tradingcards/boostercreator/'
+        try:
+            return BoosterCreatorPage(self._get(url).content)
+        except ValueError:
+            error_logger.error(
+                'ОШИБКА: кажется сессия устарела! Нужна новая Кука!'
+            )
+            raise
 
     def get_craft_bundles(self):
         """Получение списка доступных для крафта наборов дешевле 700 пыли"""
-        # Получение тела скрипта, в котором сокрыты все данные
-        # о доступных для создания наборах
-        script = next(
-            x for x in self.bundle_page_soup.find_all('script')
-            if x.contents and 'CBoosterCreatorPage.Init' in x.contents[0]
+        return self.bundle_page.bundles.filter(
+            lambda x: x.price < self.MAX_GEMS_PRICE
         )
-        # Достанем строку, в которой содержаться данные о набрах
-        bundles_string = next(
-            x for x in script.string.split('\r\n\t\t\t')
-            if 'appid' in x and 'name' in x
-        )
-        # Преобразуем ее в список
-        bundles = eval(
-            bundles_string.replace('true', 'True').replace('false', 'False')
-        )
-        return {
-            x['name']: x
-            for x in bundles[0]
-            if int(x['price']) < self.MAX_GEMS_PRICE
-        }
 
     def create_card_available_bundles(self):
         """Создание рентабельных наборов карточек"""
         # Обновим данные о доступности наборов
         self._update_available_bundles()
         # Возьмем минимальную цену мешочка
-        pouch_price, _ = self.get_gem_pouch_price()
-        good_bundles = Storage.open().get(self.GOOD_B, {})
+        pouch_price, _ = self.get_gem_pouch_price(site='craft')
+        good_bundles = self.storage.get_sector(self.GOOD_B)
         # Сортировка от самого выгодного
         games = sorted(
             ((k, v) for k, v in good_bundles.items()),
             key=lambda x: x[1]['margin'],
             reverse=True
         )
+        is_crafted = False
         for game, g_data in games:
             bundle_info = self.available_bundles.get(game)
             # Проверка доступности набора для крафта
-            if not bundle_info or bundle_info.get('unavailable'):
+            if not bundle_info or bundle_info.unavailable:
                 info_logger.info(f"{game} не доступно для крафта еще!")
                 continue
             # Проверка на наличие достаточного кол-ва самоцветов дял крафта
-            if int(bundle_info['price']) > self.gems_amount:
+            if bundle_info.price > self.gems_amount:
                 info_logger.info(
                     f'Недостаточно гемов для крафта {game}. '
-                    f'Стоимость {bundle_info["price"]}. '
+                    f'Стоимость {bundle_info.price}. '
                     f'Всего гемов: {self.gems_amount}'
                 )
                 continue
-            # Проверим рентабельность покупки на данный момент
-            if not self.get_bundle_profitability(bundle_info, pouch_price):
-                continue
-            # Если набор карточек готов к созданию - сделаем это!!!
-            is_success = self.create_card_bundle(
-                appid=bundle_info['appid'],
-                series=bundle_info['series']
+            try:
+                # Проверим рентабельность покупки на данный момент
+                if not self.get_bundle_profitability(bundle_info, pouch_price):
+                    continue
+                # Если набор карточек готов к созданию - сделаем это!!!
+                result = self.create_card_bundle(
+                    appid=bundle_info.appid,
+                    series=bundle_info.series
+                )
+            except SteamUnavailableError as error:
+                # Остальные наборы скрафтим в следующем цикле
+                error_logger.error(f'Крафт отложен: {error}')
+                break
+            is_success = result is not None
+            # Обновим данные без перезагрузки страницы
+            if is_success:
+                is_crafted = True
+                self._apply_craft_result(bundle_info, result)
+            extra = dict(
+                account=self.account, phase='craft', bundle=game,
+                margin=g_data['margin']
             )
-            # Обновим данные
-            self._update_gems_amount()
             info_logger.info(
                 f"{game} "
                 f"{'крафт удался' if is_success else 'крафт провалился'}. "
-                f"Навар {g_data['profit']} руб. на 1000 гемов."
+                f"Навар {g_data['profit']} руб. на 1000 гемов.",
+                extra=extra
             )
             if is_success:
                 sell_logger.info(
                     f"{game} крафт удался. "
-                    f"Навар {g_data['profit']} руб. на 1000 гемов."
+                    f"Навар {g_data['profit']} руб. на 1000 гемов.",
+                    extra=extra
                 )
                 # Обновим статистику
-                StatsStorage.inc_crafted_bundles()
-                StatsStorage.inc_gems_spent(int(bundle_info["price"]))
+                self.stats_storage.inc_crafted_bundles()
+                self.stats_storage.inc_gems_spent(bundle_info.price)
+        # Сверимся со Steam один раз после всех крафтов
+        if is_crafted:
+            self._update_gems_amount()
+            self._update_available_bundles()
 
     def get_all_bundles_profitability(self):
         """Получение только рентабельных наборов"""
-        # Возьмем минимальную цену мешочка
-        _, pouch_price = self.get_gem_pouch_price()
-        # Подгрузим нерентабельные наборы
-        bad_bundles = Storage.open().get(self.BAD_B, {})
-        bundles_count = len(self.available_bundles)
+        # Возьмем минимальную цену мешочка (в прерванном цикле
+        # цена уже известна, иначе цены наборов с ней не сравнить)
+        pouch_price = self.checkpoint.get_pouch_price()
+        if pouch_price is None:
+            _, pouch_price = self.get_gem_pouch_price()
+            self.checkpoint.set_pouch_price(pouch_price)
+        info_logger.info(
+            f"Наборов доступно для крафта: {len(self.available_bundles)}"
+        )
+        # Проверим только те наборы, которым пришло время по расписанию,
+        # или все, если полную проверку запросили через API управления.
+        # Изменившиеся с прошлого цикла наборы попадут в расписание сразу
+        self._apply_bundles_diff()
+        if Control.take_rescan(self.account):
+            names = list(self.available_bundles)
+        else:
+            names = self.scheduler.due(
+                self.available_bundles, limit=self.SCAN_BUDGET
+            )
+        bundles = [self.available_bundles[name] for name in names]
+        bundles_count = len(bundles)
         info_logger.info(f"Наборов предстоит проверить: {bundles_count}")
 
-        for num, bundle in enumerate(self.available_bundles.values(), start=1):
-            # Если не известно время последнего получения
-            # данных о рентабельности
-            last_updated = bad_bundles.get(bundle['name'], {}).get('updated')
-            info_logger.info(f"Проверяется: {num}/{bundles_count}")
-            if last_updated:
-                # Время последнего обновления набора и текущее время
-                last_updated, dtn = parse(last_updated), datetime.now()
-                # Если время обновления не устарело, то пропустим
-                if dtn < last_updated + t_delta(hours=self.BAD_B_ACTUAL_HOURS):
-                    continue
-            self.get_bundle_profitability(bundle, pouch_price)
+        if self.BULK_PRICING:
+            bundles = self._prefilter_bundles(bundles, pouch_price)
+            info_logger.info(
+                f"Наборов после отбора по сводке цен: {len(bundles)}"
+            )
+        # Цены, собранные до сбоя, повторно не запрашиваются
+        restored = self.checkpoint.get_prices()
+        if restored:
+            info_logger.info(f"Цен собрано до сбоя: {len(restored)}")
+        priced = [
+            (bundle, *restored[bundle.name])
+            for bundle in bundles if bundle.name in restored
+        ]
+        bundles = [x for x in bundles if x.name not in restored]
+        started = time.perf_counter()
+        if priced:
+            self._evaluate_bundles(priced, pouch_price)
+        # Запросы, разбор страниц, расчет и запись идут одновременно
+        ScanPipeline(self, pouch_price, self.SCAN_CONCURRENCY).run(bundles)
+        Metrics.track_scan(
+            bundles_count, time.perf_counter() - started,
+            account=self.account
+        )
+
+    def get_booster_packs_index(self):
+        """Сводка по всем наборам на торговой площадке (общая)"""
+        return self.QUOTES.get(
+            self.BOOSTER_PACKS_KEY, self._fetch_booster_packs_index,
+            site='index'
+        )
 
-    def get_bundle_profitability(self, bundle, pouch_price, retry=True):
+    def _fetch_booster_packs_index(self):
+        """Постраничный сбор сводки по наборам на торговой площадке"""
+        url = f'{self.BASE_URL}/market/search/render/'
+        index = BoosterPacksIndex()
+        start = 0
+        while index.total_count is None or start < index.total_count:
+            params = {
+                'query': '',
+                'start': start,
+                'count': self.BULK_PAGE_SIZE,
+                'search_descriptions': 0,
+                'sort_column': 'name',
+                'sort_dir': 'asc',
+                'appid': 753,
+                'category_753_item_class[]': 'tag_item_class_5',
+                'currency': 5,
+                'norender': 1,
+            }
+            try:
+                response = self._get(url, params).json()
+            except (ValueError, SteamUnavailableError):
+                response = {}
+            if not response.get('success') or not response.get('results'):
+                error_logger.error(
+                    f'Сводка по наборам получена не полностью: {start}/'
+                    f'{index.total_count}'
+                )
+                return index
+            index.total_count = response['total_count']
+            index.add_page(response['results'])
+            start += len(response['results'])
+        index.complete = True
+        return index
+
+    def _prefilter_bundles(self, bundles, pouch_price):
+        """
+        Отбор наборов, которые могут оказаться рентабельными.
+        Максимальная цена покупки всегда ниже минимальной цены продажи,
+        поэтому, если даже по цене продажи набор не рентабелен, точную
+        цену можно не запрашивать
+        :return: наборы, для которых нужна точная цена
+        """
+        index = self.get_booster_packs_index()
+        known, unknown = [], []
+        for bundle in bundles:
+            is_known, sell_price = index.get_sell_price(bundle)
+            if is_known:
+                known.append((bundle, sell_price, sell_price))
+            else:
+                unknown.append(bundle)
+        if not known:
+            return unknown
+        estimation = ProfitabilityEngine.evaluate(
+            gems_prices=[x[0].price for x in known],
+            sell_prices=[x[1] for x in known],
+            buy_prices=[x[2] for x in known],
+            pouch_price=pouch_price,
+            min_margin=self.MINIMAL_MARGIN
+        )
+        rejected = [x for num, x in enumerate(known) if estimation.bad[num]]
+        # Оценка сверху лишь откладывает следующую проверку отсеянных
+        self._evaluate_bundles(rejected, pouch_price, is_estimation=True)
+        candidates = [
+            x[0] for num, x in enumerate(known) if estimation.good[num]
+        ]
+        return candidates + unknown
+
+    def get_bundle_profitability(self, bundle, pouch_price):
         """Получение рентабельности набора"""
-        try:
-            sell_price, buy_price = self.get_bundle_price_range(bundle['name'])
-            # Поспим чуток от микробана подальше
-            sleep(random.randint(1, 4))
-            # Если нет ценника продажи, значит набор никто не продает, а это
-            # значит, что его продавать нельзя
-            # (способ не надежный, но пока что есть то есть)
-            if not sell_price:
-                # Прихроним информацию о нерентабельном наборе
-                self._write_bundle_info(bundle, -1000, self.BAD_B)
-                return
-        except Exception:
-            # Если возникла ошибка, запустим еще раз спустя время
-            # с флагом, которой не запустит в случае ошибки повторно
-            # во избежании рекурсии
-            if retry:
-                sleep(1.5)
-                info_logger.info(f"{bundle}: перезапуск запроса!!!!!!!")
-                self.get_bundle_profitability(bundle, pouch_price, retry=False)
+        prices = self._get_bundle_prices(bundle, site='craft')
+        if not prices:
             return
-        # Если нет лотов на покупку, то сразу пропускаем
-        if not buy_price:
+        evaluation = self._evaluate_bundles([(bundle, *prices)], pouch_price)
+        if evaluation.good[0]:
+            return {bundle.name: (evaluation.margins[0] / 100)}
+
+    @classmethod
+    def what_if(cls, pouch_prices, min_margins, account=None):
+        """
+        Пересчет рентабельности по последним собранным ценам без запросов
+        :param pouch_prices: варианты цены мешка самоцветов
+        :param min_margins: варианты минимальной маржи
+        :param account: аккаунт, чьи цены пересчитываются
+        :return: {(цена мешка, порог): [рентабельные наборы от лучшего]}
+        """
+        prices = Storage.for_account(account).get_sector(cls.PRICES)
+        names = list(prices)
+        margins, good = ProfitabilityEngine.sweep(
+            [prices[x]['gems_price'] for x in names],
+            [prices[x]['sell_price'] for x in names],
+            [prices[x]['buy_price'] for x in names],
+            pouch_prices,
+            min_margins
+        )
+        result = {}
+        for p_num, pouch_price in enumerate(pouch_prices):
+            for m_num, min_margin in enumerate(min_margins):
+                indexes = [
+                    x for x in margins[p_num].argsort()[::-1]
+                    if good[p_num, m_num, x]
+                ]
+                result[pouch_price, min_margin] = [
+                    (names[x], int(margins[p_num, x])) for x in indexes
+                ]
+        return result
+
+    def _get_bundle_prices(self, bundle, site='scan'):
+        """
+        Цены продажи и покупки набора
+        :return: (цена продажи, цена покупки) или None при ошибке
+        """
+        # Сбои сети и ответы 5xx/429 уже повторены в SteamSession,
+        # а непроверенный набор останется в расписании на следующий цикл.
+        # Если Steam недоступен, следующие запросы тоже не пройдут
+        try:
+            return self.get_bundle_price_range(bundle.name, site)
+        except SteamUnavailableError:
+            raise
+        except Exception as error:
+            error_logger.error(f'{bundle.name}: цены не получены. {error}')
+        return None
+
+    def _evaluate_bundles(self, priced, pouch_price, is_estimation=False):
+        """
+        Расчет рентабельности наборов и запись результатов
+        :param priced: [(набор, цена продажи, цена покупки)]
+        :param is_estimation: цены приблизительные (не сохраняются)
+        :return: Evaluation
+        """
+        evaluation = self._rate_bundles(priced, pouch_price)
+        self._persist_evaluation(priced, evaluation, is_estimation)
+        return evaluation
+
+    def _rate_bundles(self, priced, pouch_price):
+        """Расчет рентабельности наборов (без записи)"""
+        return ProfitabilityEngine.evaluate(
+            gems_prices=[x[0].price for x in priced],
+            sell_prices=[x[1] for x in priced],
+            buy_prices=[x[2] for x in priced],
+            pouch_price=pouch_price,
+            min_margin=self.MINIMAL_MARGIN
+        )
+
+    def _persist_evaluation(self, priced, evaluation, is_estimation=False):
+        """Запись результатов расчета: цены, плохие и хорошие наборы"""
+        if is_estimation:
+            self._persist_estimation(priced, evaluation)
             return
-        # Наборов карточек получится с одного мешочка
-        bundles_count = 1000 / int(bundle['price'])
-        # С реализации одного мешка пыли этим набором получится
-        income_per_pouch = round(bundles_count * buy_price)
-        # Маржа набора
-        margin = income_per_pouch - pouch_price
-        # Если она положительная и больше минимальной маржи - добавим игру
-        if margin and margin > self.MINIMAL_MARGIN:
-            info_logger.info(
-                f"ОТЛИЧНЫЙ НАБОР: {bundle['name']} ({margin / 100} руб.)"
+        now = datetime.now().isoformat()
+        with self.storage.batch():
+            self.storage.write(
+                {
+                    bundle.name: dict(
+                        sell_price=sell_price,
+                        buy_price=buy_price,
+                        gems_price=bundle.price,
+                        updated=now
+                    )
+                    for bundle, sell_price, buy_price in priced
+                },
+                self.PRICES
             )
-            # Хороший набор добавим в хранилище
-            self._write_bundle_info(bundle, margin, self.GOOD_B)
-            return {bundle['name']: (margin / 100)}
-        # Прихроним информацию о нерентабельном наборе
-        self._write_bundle_info(bundle, margin, self.BAD_B)
+            for num, (bundle, _, _) in enumerate(priced):
+                # Если нет ценника продажи, значит набор никто не продает,
+                # а это значит, что его продавать нельзя
+                # (способ не надежный, но пока что есть то есть)
+                if evaluation.no_sellers[num]:
+                    self._write_bundle_info(
+                        bundle, ProfitabilityEngine.NO_SELLERS_MARGIN,
+                        self.BAD_B
+                    )
+                    self._schedule_recheck(bundle, None)
+                # Если нет лотов на покупку, то сразу пропускаем
+                elif evaluation.no_buyers[num]:
+                    self._schedule_recheck(bundle, None)
+                else:
+                    margin = int(evaluation.margins[num])
+                    self._schedule_recheck(bundle, margin)
+                    if not evaluation.good[num]:
+                        # Прихроним информацию о нерентабельном наборе
+                        self._write_bundle_info(bundle, margin, self.BAD_B)
+            # Хорошие наборы добавим в хранилище, начиная с самого выгодного
+            for num in evaluation.ranking:
+                bundle, margin = priced[num][0], int(evaluation.margins[num])
+                info_logger.info(
+                    f"ОТЛИЧНЫЙ НАБОР: {bundle.name} ({margin / 100} руб.)",
+                    extra=dict(
+                        account=self.account, bundle=bundle.name,
+                        margin=margin
+                    )
+                )
+                self._write_bundle_info(bundle, margin, self.GOOD_B)
+                Control.set_good_bundle(self.account, bundle.name, margin)
+
+    def _persist_estimation(self, priced, evaluation):
+        """
+        Отсеянные по сводке цен наборы: оценка сверху только откладывает
+        их следующую проверку, а в плохие наборы и историю маржи
+        не записывается
+        """
+        with self.storage.batch():
+            for num, (bundle, _, _) in enumerate(priced):
+                is_unsellable = (
+                    evaluation.no_sellers[num] or evaluation.no_buyers[num]
+                )
+                margin = None if is_unsellable else int(evaluation.margins[num])
+                self._schedule_recheck(bundle, margin, estimated=True)
 
-    def get_gem_pouch_price(self):
+    def get_gem_pouch_price(self, site='scan'):
         """Цена мешка самоцветов (1000 гемов)"""
-        url = 'https://steamcommunity.com/market/itemordershistogram'
-        params = dict(
-            country='RU',
-            language='russian',
-            currency=5,
-            item_nameid=26463978,
-            two_factor=0
-        )
-        response = self._get(url, params).json()
-        return self._get_prices(response)
+        return self._get_item_prices(self.GEM_POUCH_ITEM_ID, site)
 
-    def get_bundle_price_range(self, name):
+    def get_bundle_price_range(self, name, site='scan'):
         """
         Получение минимальной цены продажи набора
+        :param site: место вызова, от него зависит свежесть цены
+                     (см. QUOTE_MAX_AGE)
         :return (цена по котрой продают, цена по которой покупают)
         """
-        url = 'https://steamcommunity.com/market/search'
-        params = dict(q=f'{name} Booster Pack')
-        soup = BeautifulSoup(self._get(url, params).content, 'html.parser')
-        # Найдем среди списка карточек нужную
-        search_class = (
-            "market_listing_row "
-            "market_recent_listing_row "
-            "market_listing_searchresult"
-        )
-        items = soup.find_all('div', {"class": search_class})
-        if not items:
+        is_cached = name in self._load_market_items()
+        item = self._get_market_item(name)
+        if not item:
             return None, None
-        item = (
-            next(x.attrs for x in items if name in x.attrs['data-hash-name'])
+        try:
+            return self._get_market_item_prices(name, item, site)
+        except UnknownItemError:
+            if not is_cached:
+                raise
+        # Сохраненный идентификатор устарел - найдем его заново
+        item = self._get_market_item(name)
+        if not item:
+            return None, None
+        return self._get_market_item_prices(name, item, site)
+
+    def _get_market_item_prices(self, name, item, site='scan'):
+        """
+        Цены предмета набора. Если Steam не знает предмет,
+        он забывается, а UnknownItemError пробрасывается дальше
+        """
+        try:
+            if not item.get('item_nameid'):
+                raise UnknownItemError(f'{name}: нет идентификатора предмета')
+            return self._get_item_prices(item['item_nameid'], site)
+        except UnknownItemError:
+            info_logger.info(f"{name}: идентификатор предмета устарел")
+            self._forget_market_item(name)
+            raise
+
+    def _get_market_item(self, name):
+        """Данные о предмете торговой площадки: из кэша или от Steam"""
+        item = self._load_market_items().get(name)
+        if item:
+            return item
+        # Один и тот же предмет ищет только один поток (аккаунт)
+        with self._market_items_lock:
+            name_lock = self._market_items_locks.setdefault(
+                name, threading.Lock()
+            )
+        with name_lock:
+            item = self._load_market_items().get(name)
+            if item:
+                return item
+            item = self._find_market_item(name)
+            if item:
+                self._remember_market_item(name, item)
+        return item
+
+    def _find_market_item(self, name):
+        """Поиск предмета на торговой площадке"""
+        item = self._find_market_item_in_index(name)
+        if not item:
+            item = MarketPages.extract_search_item(
+                self._get(*self._search_request(name)).content, name
+            )
+            if not item:
+                return None
+        # Идентификатор для поиска цены есть только на странице предмета
+        item_nameid = MarketPages.extract_item_nameid(
+            self._get(self._listing_url(item)).content
         )
-        # Сформируем URL для поиска минимальной цены
-        base_url = 'https://steamcommunity.com/market/listings'
-        url = f"{base_url}/{item['data-appid']}/{item['data-hash-name']}"
-        soup = BeautifulSoup(self._get(url).content, 'html.parser')
-        script = next(
-            x.contents[0] for x in soup.find_all('script') if
-            x.contents and 'Market_LoadOrderSpread' in x.contents[0]
+        return self._make_market_item(item, item_nameid)
+
+    def _search_request(self, name):
+        """Адрес и параметры поиска набора: (url, params)"""
+        return (
+            f'{self.BASE_URL}/market/search',
+            dict(q=f'{name} Booster Pack')
         )
-        wanted_row = next(
-            x for x in script.string.split('\r\n\t\t')
-            if 'Market_LoadOrderSpread' in x
+
+    def _listing_url(self, item):
+        """Адрес страницы предмета"""
+        return (
+            f"{self.BASE_URL}/market/listings/"
+            f"{item['data-appid']}/{item['data-hash-name']}"
         )
-        item_id = (
-            wanted_row.lstrip('Market_LoadOrderSpread(').split(')')[0].strip()
+
+    @staticmethod
+    def _make_market_item(item, item_nameid):
+        return dict(
+            appid=item['data-appid'],
+            market_hash_name=item['data-hash-name'],
+            item_nameid=item_nameid
         )
-        # Запрорс для получения ценника
-        url = 'https://steamcommunity.com/market/itemordershistogram'
+
+    def _find_market_item_in_index(self, name):
+        """Предмет из уже собранной сводки по наборам (без запросов)"""
+        index = self.QUOTES.peek(self.BOOSTER_PACKS_KEY)
+        listing = index and index.by_name.get(name)
+        if not listing:
+            return None
+        return {
+            'data-appid': listing['appid'],
+            'data-hash-name': listing['market_hash_name']
+        }
+
+    def _get_item_prices(self, item_nameid, site='scan'):
+        """Цены покупки и продажи предмета (общие для всех аккаунтов)"""
+        return self.QUOTES.get(
+            str(item_nameid), lambda: self._fetch_item_prices(item_nameid),
+            max_age=self.QUOTE_MAX_AGE.get(site), site=site
+        )
+
+    def _fetch_item_prices(self, item_nameid):
+        """Запрос цен покупки и продажи предмета"""
+        url = f'{self.BASE_URL}/market/itemordershistogram'
         params = dict(
             country='RU',
             language='russian',
             currency=5,
-            item_nameid=item_id,
+            item_nameid=item_nameid,
             two_factor=0
         )
-        response = self._get(url, params).json()
-        return self._get_prices(response)
+        response = self._get(url, params)
+        try:
+            histogram = response.json() or {}
+        except ValueError:
+            histogram = {}
+        success = histogram.get('success')
+        if success != 1:
+            if (response.status_code == 200
+                    and success in self.UNKNOWN_ITEM_RESULTS):
+                raise UnknownItemError(f'Предмет {item_nameid} не найден')
+            raise ValueError(
+                f'Цена предмета {item_nameid} не получена: '
+                f'ответ {response.status_code}, success={success}'
+            )
+        if self.PRICE_HISTORY:
+            PriceHistory.append_histogram(item_nameid, histogram)
+        return self._get_prices(histogram)
 
     def sell_exists_bundles(self):
         """Продажа всех имеющитхся бандлов в инвенторе"""
         # Необохдимо предотвратить продажу наборов,
         # которые остутсвуют в списке рентабельных
-        good_bundles = Storage.open().get(self.GOOD_B)
+        good_bundles = self.storage.get_sector(self.GOOD_B)
         if not good_bundles:
             info_logger.info('Необнаружено рентабельлных наборов для продажи')
             return
 
-        cards_bundles = self.get_inventory_cards()
-        for bundle in cards_bundles:
+        # Сгруппируем одинаковые наборы, чтобы узнать цену один раз
+        groups = {}
+        for bundle in self.get_inventory_cards():
             pure_name = bundle['name'].replace('Booster Pack', '').strip()
             if pure_name not in good_bundles:
                 info_logger.info(
@@ -361,53 +809,120 @@ class SteamUser:
                     f'Пропускаем!'
                 )
                 continue
-            # Уточним цену на момент продажи
-            _, price = self.get_bundle_price_range(
-                bundle['name'].strip('Booster Pack')
-            )
-            response = self._sell_bundle_card(bundle, price)
-            if response['success']:
-                msg = (
-                    f'Набор {bundle["name"]} выставлен за {price / 100} руб.!'
-                )
-                sell_logger.info(msg)
-                # Обновление статистики
-                # Заработано
-                earned = round(
-                    good_bundles[pure_name]['margin']
-                    / (1000 / int(good_bundles[pure_name]['gems_price']))
+            groups.setdefault(pure_name, []).append(bundle)
+
+        orders = []
+        for pure_name, bundles in groups.items():
+            # Уточним цену на момент продажи: котировка всегда свежая
+            _, price = self.get_bundle_price_range(pure_name, site='sell')
+            if not price:
+                info_logger.info(f'Набор {pure_name} никто не покупает!')
+                continue
+            orders.extend((pure_name, bundle, price) for bundle in bundles)
+
+        # Заявки уходят параллельно, частоту ограничивает RATE_LIMITER
+        earned, sold_count = 0, 0
+        with ThreadPoolExecutor(max_workers=self.SELL_CONCURRENCY) as pool:
+            futures = {
+                pool.submit(self._sell_bundle_card, order[1], order[2]): order
+                for order in orders
+            }
+            for future in as_completed(futures):
+                pure_name, bundle, price = futures[future]
+                extra = dict(
+                    account=self.account, phase='sell', bundle=pure_name,
+                    price=price
                 )
-                StatsStorage.inc_money_earned(earned)
-                StatsStorage.inc_sold_bundles()
-            else:
-                msg = f'Ошибка выставления набора {bundle["name"]}. {response}'
-                error_logger.error(msg)
+                try:
+                    response = future.result()
+                except Exception as error:
+                    response = dict(success=False, error=str(error))
+                if response.get('success'):
+                    msg = (
+                        f'Набор {bundle["name"]} выставлен '
+                        f'за {price / 100} руб.!'
+                    )
+                    sell_logger.info(msg, extra=extra)
+                    # Заработано
+                    earned += round(
+                        good_bundles[pure_name]['margin']
+                        / (1000 / int(good_bundles[pure_name]['gems_price']))
+                    )
+                    sold_count += 1
+                else:
+                    msg = (
+                        f'Ошибка выставления набора {bundle["name"]}. '
+                        f'{response}'
+                    )
+                    error_logger.error(msg, extra=extra)
+                info_logger.info(msg, extra=extra)
 
-            info_logger.info(msg)
+        # Обновление статистики разом по итогам продаж
+        if sold_count:
+            self.stats_storage.inc_money_earned(earned)
+            self.stats_storage.inc_sold_bundles(sold_count)
 
     def get_inventory_cards(self):
-        """Получение идентификаторов наборов карт из инвенторя"""
+        """
+        Наборы карт из инвентаря, которые можно продать.
+        Инвентарь читается постранично, поэтому в памяти держится
+        только текущая страница. Если страница не получена, чтение
+        останавливается: остальные наборы продадутся в следующем цикле
+        """
         app_id, steam_id = self._get_inventory_identifiers()
-        url = (
-            f'https://steamcommunity.com/inventory/'
-            f'{steam_id}/{app_id}/6'
-        )
-        response = self._get(url).json()
-        assets = {
-            (x['classid'], x['instanceid']): x for x in response['assets']
-        }
-        cards = [
-            # Объеденим инфомацию о наборе в ассетами
-            {**x, **assets[(x['classid'], x['instanceid'])]}
-            for x in response['descriptions']
+        url = f'{self.BASE_URL}/inventory/{steam_id}/{app_id}/6'
+        params = {'count': self.INVENTORY_PAGE_SIZE}
+        while True:
+            try:
+                response = self._get(url, params=params)
+                if (response.status_code != 200
+                        and 'start_assetid' not in params):
+                    # Возможно, идентификаторы устарели: узнаем их заново
+                    app_id, steam_id = self._get_inventory_identifiers(
+                        reload=True
+                    )
+                    url = f'{self.BASE_URL}/inventory/{steam_id}/{app_id}/6'
+                    response = self._get(url, params=params)
+            except SteamUnavailableError as error:
+                response = error.response
+            page = self._read_inventory_page(response)
+            if page is None:
+                break
             # Интересуют только наборы, которые можно продать
-            if x['type'] == 'Booster Pack' and x['marketable']
-        ]
-        return cards
+            descriptions = {
+                (x['classid'], x['instanceid']): x
+                for x in page.get('descriptions', ())
+                if x['type'] == 'Booster Pack' and x['marketable']
+            }
+            for asset in page.get('assets', ()):
+                description = descriptions.get(
+                    (asset['classid'], asset['instanceid'])
+                )
+                if description:
+                    # Объеденим инфомацию о наборе в ассетами
+                    yield {**description, **asset}
+            if not page.get('more_items'):
+                break
+            params['start_assetid'] = page['last_assetid']
+
+    @staticmethod
+    def _read_inventory_page(response):
+        """Страница инвентаря или None, если Steam ее не отдал"""
+        try:
+            page = response.json() if response.status_code == 200 else None
+        except ValueError:
+            page = None
+        if not page or page.get('success') != 1:
+            error_logger.error(
+                f'Инвентарь прочитан не полностью: '
+                f'ответ {response.status_code}'
+            )
+            return None
+        return page
 
     def _sell_bundle_card(self, bundle, price):
         """Выставление на продажу набора карт"""
-        url = 'https://steamcommunity.com/market/sellitem/'
+        url = f'{self.BASE_URL}/market/sellitem/'
         data = dict(
             sessionid=self.cookies['sessionid'],
             appid=bundle['appid'],
@@ -421,9 +936,16 @@ class SteamUser:
         response = self._post(url=url, data=data, referer=True).json()
         return response
 
-    def _get_inventory_identifiers(self):
-        """Получение инвенаря Steam"""
-        url = f'https://steamcommunity.com/id/{self.username}/inventory/'
+    def _get_inventory_identifiers(self, reload=False):
+        """
+        Идентификаторы инвентаря Steam: (app_id, steam_id).
+        Страница инвентаря загружается, только если их еще нет в БД
+        """
+        identifiers = self.storage.get_sector(self.INVENTORY)
+        if identifiers and not reload:
+            return identifiers['app_id'], identifiers['steam_id']
+
+        url = f'{self.BASE_URL}/id/{self.username}/inventory/'
         soup = BeautifulSoup(self._get(url).content, 'html.parser')
         items = soup.find('select', {'id': 'responsive_inventory_select'})
         steam_identifiers = next(
@@ -442,81 +964,174 @@ class SteamUser:
             if 'UserYou.SetSteamId' in x
         )
         steam_id = re.search(r'\d+', wanted_row).group()
+        self.storage.write(
+            dict(app_id=app_id, steam_id=steam_id), self.INVENTORY
+        )
         return app_id, steam_id
 
+    def _pause(self, seconds):
+        """Пауза перед повтором запроса (ее прерывают команды управления)"""
+        self.SLEEP(seconds, self.account, new_rescan_only=True)
+
     def _get(self, url, params=None):
         """Базовый метод для GET-запросов"""
-        sleep(random.randint(1, 2))
-        try:
-            return requests.get(
-                url=url,
-                params=params,
-                cookies=self.cookies,
-                headers=self.headers
-            )
-        except ProtocolError as error:
-            error_logger.error(f'{error}. Data: {params}')
-            sleep(6)
-            return requests.get(
-                url=url,
-                params=params,
-                cookies=self.cookies,
-                headers=self.headers
-            )
+        return self.session.get(url, params=params)
 
     def _post(self, url, data=None, referer=False):
         """Базовый метод для POST-запросов"""
         # Необходимо изменить хэдер для этого запроса
-        sleep(random.randint(1, 3))
-        headers = dict(**self.headers)
         content_type = 'application/x-www-form-urlencoded; charset=UTF-8'
-        headers['Content-Type'] = content_type
+        headers = {'Content-Type': content_type}
         # Если есть заголовок refer
         if referer:
-            r_url = f'https://steamcommunity.com/id/{self.username}/inventory/'
+            r_url = f'{self.BASE_URL}/id/{self.username}/inventory/'
             headers['Referer'] = r_url
-        try:
-            return requests.post(
-                url=url,
-                data=data,
-                headers=headers,
-                cookies=self.cookies
-            )
-        except ProtocolError as error:
-            error_logger.error(f'{error}. Data: {data}')
-            sleep(6)
-            return requests.post(
-                url=url,
-                data=data,
-                headers=headers,
-                cookies=self.cookies
-            )
+        return self.session.post(url, data=data, headers=headers)
+
+    def _set_bundle_page(self, page):
+        """Новая страница наборов (сохраняется для продолжения цикла)"""
+        self.bundle_page = page
+        self.checkpoint.set_page(page.to_state())
 
     def _update_available_bundles(self, init=False):
         """Обновление данных о доступных наборах для крафта"""
-        try:
-            self.available_bundles = self.get_craft_bundles()
-        except StopIteration:
-            error_logger.error(
-                'ОШИБКА: кажется сессия устарела! Нужна новая Кука!'
-            )
-
+        self.available_bundles = self.get_craft_bundles()
         # Получим имя пользователя
         if init:
-            query = 'a', {'class': 'menuitem supernav username'}
-            anchor = self.bundle_page_soup.find(*query)
-            url_elements = anchor.attrs['href'].split('/')
-            for num, elem in enumerate(url_elements):
-                if elem == 'id':
-                    self.username = url_elements[num + 1]
-                    break
-
-    def _update_gems_amount(self):
+            self.username = self.bundle_page.username
+
+    def _update_gems_amount(self, reload=True):
         """Обновление данных о колчестве имеющихся гемов"""
-        self.bundle_page_soup = self.load_bundles_page()
+        if reload:
+            self._set_bundle_page(self.load_bundles_page())
         self.gems_amount = self.get_dust_amount()
+        Control.update(self.account, gems=self.gems_amount)
         info_logger.info(f'Самоцветов доступно: {self.gems_amount}')
 
+    def _apply_craft_result(self, bundle_info, result):
+        """Учет удачного крафта в локальных данных"""
+        expected_gems = self.gems_amount - bundle_info.price
+        # Steam возвращает остаток самоцветов в ответе на крафт
+        gems_amount = result.get('goo_amount')
+        self.gems_amount = (
+            expected_gems if gems_amount is None else int(gems_amount)
+        )
+        Control.update(self.account, gems=self.gems_amount)
+        # Набор для одной игры можно создавать не чаще раза в сутки
+        self.available_bundles.set_unavailable(
+            bundle_info.name, time.time() + 24 * 3600
+        )
+        self.checkpoint.add_crafted(bundle_info.name, self.gems_amount)
+        # Если данные разошлись, то локальному состоянию верить нельзя
+        if self.gems_amount != expected_gems:
+            info_logger.info(
+                f'Самоцветов {self.gems_amount} вместо ожидаемых '
+                f'{expected_gems}. Обновим страницу наборов.'
+            )
+            self._update_gems_amount()
+            self._update_available_bundles()
+
+    @classmethod
+    def _load_market_items(cls):
+        """Загрузка кэша предметов торговой площадки из БД"""
+        with cls._market_items_lock:
+            if cls._market_items is None:
+                cls._market_items = Storage.get_sector(cls.MARKET_ITEMS)
+            return cls._market_items
+
+    @classmethod
+    def _remember_market_item(cls, name, item, persist=True):
+        """
+        Сохранение найденного предмета в кэш
+        :param persist: сразу записать в БД (иначе запись за вызывающим)
+        """
+        with cls._market_items_lock:
+            cls._load_market_items()[name] = item
+            if persist:
+                Storage.write({name: item}, cls.MARKET_ITEMS)
+
+    @classmethod
+    def _forget_market_item(cls, name):
+        """Удаление устаревшего предмета из кэша и БД"""
+        with cls._market_items_lock:
+            cls._load_market_items().pop(name, None)
+            Storage.remove(name, cls.MARKET_ITEMS)
+
+    def _load_scheduler(self):
+        """Загрузка расписания проверок наборов"""
+        entries = self.storage.get_sector(RecheckScheduler.SCHEDULE)
+        if not entries:
+            # Первый запуск с планировщиком: учтем прошлые проверки
+            entries = RecheckScheduler.seed_entries(
+                self.storage.get_sector(self.BAD_B), self.BAD_B_ACTUAL_HOURS
+            )
+            self.storage.write(entries, RecheckScheduler.SCHEDULE)
+        return RecheckScheduler(
+            entries,
+            min_margin=self.MINIMAL_MARGIN,
+            min_interval=self.RECHECK_MIN_MINUTES * 60,
+            max_interval=self.BAD_B_ACTUAL_HOURS * 3600
+        )
+
+    def _apply_bundles_diff(self):
+        """
+        Сравнение наборов с прошлым циклом: новые, подешевевшие или
+        подорожавшие и снова доступные наборы проверяются в этом цикле,
+        только что созданные - не раньше, чем их снова можно создать,
+        а исчезнувшие удаляются из расписания
+        :return: BundleDiff или None, если сравнивать не с чем
+        """
+        digest = self.available_bundles.digest()
+        stored = self.storage.get_sector(self.BUNDLES_DIGEST).get('value')
+        if digest == stored:
+            return BundleDiff()
+        previous = self.storage.get_sector(self.BUNDLES_FINGERPRINT)
+        fingerprint = self.available_bundles.fingerprint()
+        diff = self.available_bundles.diff(previous) if previous else None
+        with self.storage.batch():
+            if diff:
+                info_logger.info(f'Изменения наборов: {diff}')
+                self._reschedule_changed(diff)
+                for name in diff.removed:
+                    self.storage.remove(name, self.BUNDLES_FINGERPRINT)
+                changed = diff.added + diff.repriced + diff.availability
+                self.storage.write(
+                    {name: fingerprint[name] for name in changed},
+                    self.BUNDLES_FINGERPRINT
+                )
+            elif not previous:
+                # Первый снимок: расписание остается как было
+                self.storage.write(fingerprint, self.BUNDLES_FINGERPRINT)
+            self.storage.write(dict(value=digest), self.BUNDLES_DIGEST)
+        return diff
+
+    def _reschedule_changed(self, diff):
+        """Расписание по изменениям наборов (записи - в пакете вызывающего)"""
+        available = [
+            name for name in diff.availability
+            if not self.available_bundles[name].unavailable
+        ]
+        entries = self.scheduler.expedite(
+            diff.added + diff.repriced + available
+        )
+        for name in diff.availability:
+            bundle = self.available_bundles[name]
+            if bundle.unavailable and bundle.available_at:
+                entry = self.scheduler.postpone(name, bundle.available_at)
+                if entry:
+                    entries[name] = entry
+        if entries:
+            self.storage.write(entries, RecheckScheduler.SCHEDULE)
+        for name in self.scheduler.forget(diff.removed):
+            self.storage.remove(name, RecheckScheduler.SCHEDULE)
+
+    def _schedule_recheck(self, bundle, margin, estimated=False):
+        """Планирование следующей проверки набора"""
+        entry = self.scheduler.record(bundle.name, margin, estimated=estimated)
+        self.storage.write(
+            {bundle.name: entry}, RecheckScheduler.SCHEDULE
+        )
+
     @staticmethod
     def _get_prices(obj):
         """Получим цену покупки и продажи из результата"""
@@ -527,16 +1142,15 @@ class SteamUser:
             int(buy_price) if buy_price else None
         )
 
-    @staticmethod
-    def _write_bundle_info(bundle, margin, primary_key):
+    def _write_bundle_info(self, bundle, margin, primary_key):
         """Запись информации о наборе в БД"""
-        Storage.write(
+        self.storage.write(
             primary_key=primary_key,
             data={
-                bundle['name']: dict(
+                bundle.name: dict(
                     profit=(margin / 100),
                     margin=margin,
-                    gems_price=bundle['price'],
+                    gems_price=bundle.price,
                     updated=datetime.now().isoformat()
                 )
             }
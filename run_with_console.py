@@ -1,6 +1,14 @@
+import multiprocessing
+
 import settings
+from logic.orchestrator import Orchestrator
 from logic.user import SteamUser
 
 
 if __name__ == '__main__':
-    SteamUser.make_money(settings.COOKIES)
+    # Процессы разбора страниц в собранном exe (см. logic.pipeline)
+    multiprocessing.freeze_support()
+    if settings.ACCOUNTS:
+        Orchestrator(settings.ACCOUNTS).run()
+    else:
+        SteamUser.make_money(settings.COOKIES)
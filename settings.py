@@ -3,4 +3,100 @@ COOKIES = 'timezoneOffset=10800,0; steamMachineAuth7656.... cookies here ... str
 
 # Минимальная прибыль, от крафта наборы карточек, за которую возьмется бот.
 # Указана в копейках.
-MIN_MARGIN = 250
\ No newline at end of file
+MIN_MARGIN = 250
+
+# Количество наборов, которые проверяются на рентабельность одновременно.
+# 1 - последовательная проверка.
+SCAN_CONCURRENCY = 4
+# Количество процессов, в которых разбираются страницы торговой площадки
+# во время проверки (0 - разбор в потоке основного процесса).
+PARSE_PROCESSES = 2
+# Размер очередей между этапами проверки: чем меньше, тем меньше памяти
+# занимают ожидающие обработки страницы и цены.
+PIPELINE_QUEUE_SIZE = 64
+# Общий лимит запросов к Steam в минуту (на все потоки сразу).
+# Превышение грозит временным баном со стороны Steam.
+REQUESTS_PER_MINUTE = 40
+# Повторы неудачных запросов (обрыв соединения, ответы 5xx):
+# сколько всего попыток и пауза после первой неудачи (в секундах),
+# которая удваивается с каждой неудачей подряд до RETRY_MAX_SECONDS.
+RETRY_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 120
+# Если Steam ответил 429 (слишком много запросов), все запросы
+# приостанавливаются на Retry-After, а если его нет - на паузу,
+# которая растет с каждым ограничением подряд (в секундах).
+THROTTLE_PAUSE_SECONDS = 60
+THROTTLE_MAX_PAUSE_SECONDS = 1800
+# Количество заявок на продажу наборов, которые отправляются одновременно.
+SELL_CONCURRENCY = 2
+
+# Хранилище данных: 'sqlite' или 'shelve' (старый формат).
+# При первом запуске с 'sqlite' данные из shelve переносятся автоматически.
+STORAGE_BACKEND = 'sqlite'
+
+# Как часто статистика сбрасывается из памяти в хранилище (в секундах).
+STATS_FLUSH_SECONDS = 300
+
+# Минимальный интервал повторной проверки рентабельности набора (в минутах).
+# Наборы, маржа которых близка к MIN_MARGIN, проверяются примерно так часто.
+RECHECK_MIN_MINUTES = 15
+# Сколько наборов можно проверить за один цикл (0 - без ограничений).
+# Первыми проверяются наборы, проверка которых просрочена сильнее всего.
+SCAN_BUDGET = 0
+
+# Сколько минут цена предмета на торговой площадке считается актуальной.
+# Котировки общие для всех аккаунтов, запущенных в одном процессе.
+QUOTE_TTL_MINUTES = 10
+# То же при проверке набора перед крафтом и перед выставлением на продажу
+# (0 - всегда запрашивать свежую цену).
+QUOTE_TTL_CRAFT_MINUTES = 3
+QUOTE_TTL_SELL_MINUTES = 0
+# Сколько котировок держать в памяти: давно не использованные вытесняются.
+QUOTE_CACHE_SIZE = 5000
+
+# Записывать все полученные цены предметов в историю (db/price_history.bin).
+# По ней show_stats.py строит отчет по играм.
+PRICE_HISTORY = True
+
+# Сколько минут после сбоя можно продолжить прерванный цикл с того же места
+# (собранные цены, этап цикла, страница наборов). Потом цикл начнется заново.
+CHECKPOINT_MAX_AGE_MINUTES = 60
+
+# Аккаунты для одновременной работы в одном процессе: {имя: строка куки}.
+# Если пусто - работает один аккаунт с куками из COOKIES.
+ACCOUNTS = {}
+
+# Предварительно отбирать наборы по сводке цен всех наборов с торговой
+# площадки (несколько больших запросов вместо поиска каждого набора).
+BULK_PRICING = True
+
+# Метрики в формате Prometheus.
+# Порт, на котором метрики отдаются по адресу http://127.0.0.1:<порт>/metrics
+# (0 - не запускать).
+METRICS_PORT = 0
+# Файл для textfile-коллектора node_exporter ('' - не писать)
+# и как часто он переписывается (в секундах).
+METRICS_TEXTFILE = ''
+METRICS_INTERVAL = 30
+
+# API управления ботом на http://127.0.0.1:<порт> (0 - не запускать):
+# через него show_stats.py показывает состояние работающего бота
+# и отправляет команды rescan, pause и resume. Запросы принимаются
+# только с токеном из файла db/control_token (его создает бот).
+CONTROL_PORT = 8765
+
+# Логи: errors_log.txt и successful_sells.txt ротируются по достижении
+# LOG_MAX_MEGABYTES (хранится LOG_BACKUP_COUNT прошлых файлов).
+# LOG_JSON_FILE - файл, куда все записи дублируются в формате JSON lines
+# с полями набора, маржи, задержки и этапа ('' - не писать).
+LOG_MAX_MEGABYTES = 5
+LOG_BACKUP_COUNT = 3
+LOG_JSON_FILE = ''
+
+# Профилирование каждого N-го цикла (cProfile + tracemalloc), 0 - выключено.
+# Можно задать и переменной окружения STEAM_CRAFTER_PROFILE.
+# Отчеты пишутся в папку PROFILE_FOLDER рядом с логами.
+# При нескольких аккаунтах (ACCOUNTS) профилирование не работает.
+PROFILE_EVERY_N_CYCLES = 0
+PROFILE_FOLDER = 'profiles'
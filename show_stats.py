@@ -1,11 +1,64 @@
-"""Скрипт служит дял отображения статистики"""
-from logic.storage import StatsStorage
+"""
+Скрипт служит дял отображения статистики.
+Если бот запущен, состояние берется у него через API управления
+(см. logic.control), иначе - из хранилища.
+Команды боту: show_stats.py rescan|pause|resume [аккаунт]
+"""
+import sys
 
+from logic.control import Control
+from logic.history import PriceHistory
+from logic.storage import Storage, StatsStorage
+
+
+def show_live(status):
+    for account, state in sorted(status['accounts'].items()):
+        print(f'Аккаунт {account}:')
+        for key, name in StatsStorage.KEYS_MAP.items():
+            value = state['stats'].get(key, 0)
+            if key == 'earned':
+                value = f'{value / 100} руб.'
+            print(f'{name}: {value}')
+        phase = 'пауза' if state['paused'] else state['phase']
+        print(f'Цикл №{state["cycle"]}, этап: {phase}')
+        if state.get('scan_total'):
+            print(
+                f'Проверено наборов: '
+                f'{state["scan_done"]}/{state["scan_total"]}'
+            )
+        if state.get('gems') is not None:
+            print(f'Самоцветов: {state["gems"]}')
+        for name, margin in state['good_bundles']:
+            print(f'ОТЛИЧНЫЙ НАБОР: {name} ({margin / 100} руб.)')
+        print()
+
+
+def show_stored():
+    try:
+        StatsStorage.show_stats()
+        print()
+        PriceHistory.show_report(Storage.get_sector('MARKET_ITEMS'))
+    except FileNotFoundError:
+        print('Бот ниразу не запускался!!')
+
+
+if len(sys.argv) > 1:
+    command = sys.argv[1]
+    if command not in Control.COMMANDS:
+        sys.exit(f'Команды: {", ".join(Control.COMMANDS)}')
+    account = f'?account={sys.argv[2]}' if len(sys.argv) > 2 else ''
+    result = Control.request(f'/{command}{account}', method='POST')
+    if result is None:
+        print('Бот не запущен или не отвечает')
+    else:
+        print(f'Команда {command}: {", ".join(result["accounts"]) or "-"}')
+    sys.exit()
 
 print('Блок статистики за все время:')
-try:
-    StatsStorage.show_stats()
-except FileNotFoundError:
-    print('Бот ниразу не запускался!!')
+status = Control.request('/status')
+if status is None:
+    show_stored()
+else:
+    show_live(status)
 
 input()
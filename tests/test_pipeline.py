@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+
+from logic.control import Control
+from logic.pipeline import ScanPipeline
+from logic.storage import Storage
+from logic.transport import CircuitBreaker
+
+Bundle = namedtuple('Bundle', 'name price')
+
+
+class Checkpoint:
+
+    def add_prices(self, name, prices):
+        pass
+
+
+class User:
+    """Пользователь Steam, чьи цены приходят без запросов"""
+
+    MARKET_ITEMS = 'MARKET_ITEMS'
+    CIRCUIT_BREAKER = CircuitBreaker()
+    storage = Storage
+    checkpoint = Checkpoint()
+
+    def __init__(self, account, first_delay=0.):
+        self.account = account
+        self.first_delay = first_delay
+        self.fetched = 0
+        self._lock = threading.Lock()
+
+    def _load_market_items(self):
+        return {f'bundle {x}': dict(item_nameid=x) for x in range(100)}
+
+    def _get_market_item_prices(self, name, item, site='scan'):
+        with self._lock:
+            self.fetched += 1
+            is_first = self.fetched == 1
+        if is_first:
+            time.sleep(self.first_delay)
+        return 100, 90
+
+    def _rate_bundles(self, chunk, pouch_price):
+        return None
+
+    def _persist_evaluation(self, priced, evaluation):
+        pass
+
+
+class Pipeline(ScanPipeline):
+    QUEUE_SIZE = 5
+    STALL_TIMEOUT = 0.5
+    STOP_CHECK = 0.05
+
+
+class ScanPipelineStallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_path = Storage.STORAGE_PATH
+        Storage.STORAGE_PATH = os.path.join(tempfile.mkdtemp(), 'storage')
+        self.bundles = [Bundle(f'bundle {x}', 1000) for x in range(100)]
+
+    def tearDown(self):
+        Storage.STORAGE_PATH = self.storage_path
+
+    def run_pipeline(self, user, timeout=10):
+        pipeline = Pipeline(user, 0, concurrency=1, parse_processes=0)
+        result = []
+        runner = threading.Thread(
+            target=lambda: result.append(pipeline.run(self.bundles)),
+            daemon=True
+        )
+        runner.start()
+        runner.join(timeout)
+        self.assertFalse(runner.is_alive(), 'проверка зависла')
+        return result[0]
+
+    def test_stall_stops_all_stages(self):
+        user = User('stall', first_delay=1)
+        with self.assertLogs('error_logger') as logs:
+            priced = self.run_pipeline(user)
+        self.assertEqual(priced, [])
+        self.assertIn('Проверка наборов остановлена', logs.output[0])
+        # После остановки запросы не продолжаются
+        self.assertLess(user.fetched, len(self.bundles))
+
+    def test_pause_is_not_a_stall(self):
+        user = User('pause')
+        Control.update(user.account, phase='profitability')
+        Control.command('pause', user.account)
+        threading.Timer(
+            1, Control.command, ('resume', user.account)
+        ).start()
+        priced = self.run_pipeline(user)
+        self.assertEqual(len(priced), len(self.bundles))
+
+
+if __name__ == '__main__':
+    unittest.main()